@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from .get_traversal_data import TraversalData
+from .phase_binning import bin_by_phase
 
 def bz_csd(lfp, **kwargs):
     """
@@ -108,11 +110,129 @@ def bz_csd(lfp, **kwargs):
 
     return csd
 
+def csd_operator(n_channels, spat_sm=0):
+    """
+    Builds the CSD as a single linear operator on a (samples, channels) LFP block: sign inversion, optional spatial
+    Savitzky-Golay smoothing (as in bz_csd) and the second spatial difference, so that csd = lfp @ operator.
+
+    Args:
+        n_channels (int): Number of channels, ordered by depth.
+        spat_sm (int): Spatial smoothing window (channels). Default is 0 (no smoothing).
+
+    Returns:
+        ndarray: Operator of shape (n_channels, n_channels - 2).
+    """
+    from scipy.signal import savgol_filter
+
+    # Spatial smoothing is linear, so its matrix is the smoothing of the identity (row i is the smoothed unit vector i)
+    smoothing = np.eye(n_channels)
+    if spat_sm > 0 and n_channels > spat_sm:
+        spat_sm = min(spat_sm | 1, n_channels - 1)
+        smoothing = savgol_filter(smoothing, window_length=spat_sm, polyorder=min(3, spat_sm - 1), axis=1)
+
+    # Second difference across channels: [1, -2, 1]
+    second_difference = np.zeros((n_channels, n_channels - 2))
+    columns = np.arange(n_channels - 2)
+    second_difference[columns, columns] = 1
+    second_difference[columns + 1, columns] = -2
+    second_difference[columns + 2, columns] = 1
+
+    return -smoothing @ second_difference
+
+def _temporal_smoothing_window(n_samples, temp_sm):
+    """
+    Savitzky-Golay window length and polynomial order for temporal smoothing, as in bz_csd, or None if no smoothing is applied.
+    """
+    if temp_sm > 0 and n_samples > temp_sm:
+        temp_sm = min(temp_sm | 1, n_samples - 1)
+        return temp_sm, min(3, temp_sm - 1)
+    return None
+
+def batched_csd(lfp, spat_sm=0, temp_sm=0, do_detrend=False):
+    """
+    Calculates the 1D approximation of current source density (CSD) for a whole LFP block or a tensor of
+    equal-length traversals at once, with the second spatial difference applied as one matrix operator (csd_operator).
+
+    Unlike bz_csd, which differentiates along the sample axis, this takes the second difference across channels,
+    as in the buzcode bz_CSD.m it was translated from, so the output has two fewer channels and the same samples.
+
+    Args:
+        lfp (ndarray): LFP data of shape (..., samples, channels), e.g. (samples, channels) or (traversals, samples, channels), with channels ordered by depth.
+        spat_sm (int): Spatial smoothing window (channels). Default is 0.
+        temp_sm (int): Temporal smoothing window (samples). Default is 0.
+        do_detrend (bool): Remove a linear trend along the sample axis before smoothing. Default is False.
+
+    Returns:
+        ndarray: CSD of shape (..., samples, channels - 2).
+    """
+    from scipy.signal import detrend, savgol_filter
+
+    lfp = np.asarray(lfp, dtype=float)
+
+    if do_detrend:
+        lfp = detrend(lfp, axis=-2)
+
+    # Temporal smoothing, for all channels and traversals at once
+    smoothing_window = _temporal_smoothing_window(lfp.shape[-2], temp_sm)
+    if smoothing_window is not None:
+        lfp = savgol_filter(lfp, window_length=smoothing_window[0], polyorder=smoothing_window[1], axis=-2)
+
+    return lfp @ csd_operator(lfp.shape[-1], spat_sm)
+
+def streaming_csd(lfp, spat_sm=0, temp_sm=0, chunk_size=100000, output_path=None):
+    """
+    Calculates a continuous CSD (as batched_csd) over a session-length LFP, reading it in chunks along the sample axis.
+    Chunks overlap by the temporal smoothing window, so the result matches batched_csd on the whole LFP.
+    Detrending is not supported, as a linear trend is defined over the whole block.
+
+    Args:
+        lfp (ndarray): LFP data of shape (samples, channels) that supports slicing along axis 0, e.g. an np.memmap.
+        spat_sm (int): Spatial smoothing window (channels). Default is 0.
+        temp_sm (int): Temporal smoothing window (samples). Default is 0.
+        chunk_size (int): Number of samples per chunk. Default is 100000.
+        output_path (str, optional): Path of a .npy file to write the CSD to as a memory map. Default is None (CSD held in memory).
+
+    Returns:
+        ndarray: CSD of shape (samples, channels - 2).
+    """
+    from scipy.signal import savgol_filter
+
+    n_samples, n_channels = lfp.shape
+    operator = csd_operator(n_channels, spat_sm)
+    smoothing_window = _temporal_smoothing_window(n_samples, temp_sm)
+    overlap = 0 if smoothing_window is None else smoothing_window[0]
+
+    if output_path is not None:
+        csd = np.lib.format.open_memmap(output_path, mode='w+', dtype=float, shape=(n_samples, n_channels - 2))
+    else:
+        csd = np.empty((n_samples, n_channels - 2))
+
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        read_start, read_stop = max(start - overlap, 0), min(stop + overlap, n_samples)
+        chunk = np.asarray(lfp[read_start:read_stop], dtype=float)
+
+        if smoothing_window is not None:
+            chunk = savgol_filter(chunk, window_length=smoothing_window[0], polyorder=smoothing_window[1], axis=0)
+
+        csd[start:stop] = chunk[start - read_start:stop - read_start] @ operator
+
+    if output_path is not None:
+        csd.flush()
+
+    return csd
+
 def calculate_csd_df(arm_cycle_df):
     '''
     Takes dataframe of LFP data with theta cycles and traversal indices
     Calculates current-source density for each traversal individually and adds to the dataframe
+
+    Also accepts a TraversalData store, in which case it returns a (samples, channels) CSD array aligned to the
+    store's samples (NaN at the first and last sample of each traversal) in place of the dataframe
     '''
+    if isinstance(arm_cycle_df, TraversalData):
+        return _calculate_csd_traversal_data(arm_cycle_df)
+
     # List of index labels which are NOT channel data (hard-coded for now)
     non_ephys_labels = ['Traversal Index', 'Cycle Index', 'Cycle Theta Phase', 'Speed']
     
@@ -142,6 +262,23 @@ def calculate_csd_df(arm_cycle_df):
         
     return csd_df, csd_index
 
+def _calculate_csd_traversal_data(traversal_data):
+    '''
+    calculate_csd_df for a TraversalData store
+    '''
+    csd_labels = [channel + '_csd' for channel in traversal_data.channels]
+    csd = np.full(traversal_data.lfp.shape, np.nan)
+
+    for traversal in range(traversal_data.n_traversals):
+        traversal_slice = traversal_data.traversal_slice(traversal)
+        traversal_csd = bz_csd(traversal_data.lfp[traversal_slice], plot_csd=False, plot_lfp=False)
+
+        # CSD has two fewer samples than LFP, so align CSD to the central samples of the traversal
+        if traversal_csd is not None:
+            csd[traversal_slice][1:-1] = traversal_csd['data']
+
+    return csd, csd_labels
+
 def mean_csd_theta_phase(arm_csd_df, arm_csd_labels):
     '''
     Takes the processed dataframe with CSD calculated, along with labels specifying which rows refer to these data
@@ -150,34 +287,17 @@ def mean_csd_theta_phase(arm_csd_df, arm_csd_labels):
     Returns original dataframe meaned across theta phase bins
     '''
     
-    ## Bin by theta phase
-    bins = np.linspace(0, 2 * np.pi, 101)
-    binned_theta = np.digitize(arm_csd_df.loc['Cycle Theta Phase'].values, bins) 
-        
+    ## Bin by theta phase, dropping samples without CSD
     csd_data = arm_csd_df.loc[arm_csd_labels]
-    csd_data.columns = binned_theta
-    csd_data = csd_data.dropna(axis = 1)
-    
-    ## Mean CSD for each channel in that bin
-    # Extract unique column names
-    unique_columns = set(csd_data.columns)
-
-    # Initialize a dictionary to hold our new columns
-    mean_columns = {}
-
-    # Calculate mean for each unique column
-    for col in unique_columns:
-        # Select columns with the current unique name
-        selected_columns = csd_data.loc[:, col]
-
-        # Calculate the mean for these columns
-        mean_value = selected_columns.mean(axis=1)
+    has_csd = csd_data.notna().all(axis=0).to_numpy()
+    theta_phase = arm_csd_df.loc['Cycle Theta Phase'].to_numpy(dtype=float)
 
-        # Add the mean values to our dictionary
-        mean_columns[col] = mean_value
+    ## Mean CSD for each channel in each bin
+    _, mean_csd, counts, _ = bin_by_phase(csd_data.to_numpy(dtype=float)[:, has_csd].T, theta_phase[has_csd], n_bins=100)
 
-    # Create a new DataFrame from the dictionary
-    mean_csd_data = pd.DataFrame(mean_columns)
+    # Keep bins with data, numbered from 1 as by np.digitize
+    occupied_bins = counts[:, 0] > 0 if counts.shape[1] else np.zeros(len(counts), dtype=bool)
+    mean_csd_data = pd.DataFrame(mean_csd[occupied_bins].T, index=csd_data.index, columns=np.flatnonzero(occupied_bins) + 1)
     
     return mean_csd_data
     
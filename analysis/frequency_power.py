@@ -2,6 +2,10 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.signal import morlet
+import scipy.fft
+from collections import OrderedDict
+from .get_traversal_data import TraversalData
+from .phase_binning import bin_by_phase
 
 def complex_morlet_wavelet_transform(signal, frequencies, fs):
     """
@@ -37,16 +41,142 @@ def complex_morlet_wavelet_transform(signal, frequencies, fs):
     
     return wavelet_coeffs
 
-def calculate_morlet_df(arm_cycle_df, channel, lfp_sampling_rate, f_min, f_max, f_bins):
+class MorletWaveletBank:
+    """
+    Bank of complex Morlet wavelets for a set of frequencies, applied to signals with FFT convolution.
+
+    Wavelets follow the scipy.signal.morlet2 definition, with the width of each wavelet set so that it holds
+    w cycles at its frequency (s = w * fs / (2 * pi * freq)), and are built directly in the frequency domain.
+    Signals are zero-padded by the support of the widest wavelet, up to an FFT length of 2**k times 1, 1.25 or 1.5
+    (fft_length), so signals of similar length (e.g. traversals of similar duration) share an FFT length. Frequency-domain
+    wavelets are cached by (n_fft, fs, frequencies, w), with the least recently used dropped once the cache exceeds
+    max_cache_gb. All frequencies are transformed with one broadcasted multiply and inverse FFT.
+
+    Usage:
+        bank = MorletWaveletBank(frequencies=np.linspace(20, 120, 50), fs=1000)
+        wavelet_coeffs = bank.transform(signal)                          # (time x frequencies), complex128
+        power = bank.transform(signal, dtype=np.complex64, power=True)   # (time x frequencies), float32
+
+    Attributes:
+        frequencies (numpy.ndarray): Array of frequencies for which to compute the transform.
+        fs (float): Sampling frequency of the input signals.
+        w (float): Number of cycles in each wavelet (morlet2 omega0). Default is 5.
+        workers (int): Number of workers passed to scipy.fft. Default is -1 (all CPUs).
+        max_cache_gb (float): Approximate cap on the memory of cached wavelets, in GB. Default is 0.5 GB.
+    """
+
+    def __init__(self, frequencies, fs, w=5, workers=-1, max_cache_gb=0.5):
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        self.fs = fs
+        self.w = w
+        self.workers = workers
+        self.max_cache_gb = max_cache_gb
+
+        # Wavelet widths (in samples), and the padding needed to avoid wrap-around of the widest wavelet
+        self.scales = self.w * self.fs / (2 * np.pi * self.frequencies)
+        self.pad_length = int(np.ceil(5 * self.scales.max()))
+
+        self._cache = OrderedDict()
+
+    def fft_length(self, n):
+        """
+        Return the FFT length for a signal of n samples: n plus padding, rounded up to 2**k times 1, 1.25 or 1.5.
+        These lengths are fast for scipy.fft, add at most a third to the padded length, and give only three cached
+        wavelet sets per doubling of signal length.
+
+        Parameters:
+        - n (int): Number of samples in the signal.
+
+        Returns:
+        - int: FFT length.
+        """
+        n_padded = max(n + self.pad_length, 4)
+        step = 2 ** (int(n_padded - 1).bit_length() - 3)
+        return next(step * multiple for multiple in (4, 5, 6, 8) if step * multiple >= n_padded)
+
+    def get_wavelets(self, n_fft, dtype=np.complex128):
+        """
+        Return the frequency-domain wavelets for an FFT length, from the cache if already computed.
+
+        Parameters:
+        - n_fft (int): FFT length.
+        - dtype: Complex data type of the transform. Wavelets are returned as the matching real type.
+
+        Returns:
+        - numpy.ndarray: Frequency-domain wavelets, with dimensions (n_fft x frequencies).
+        """
+        real_dtype = np.finfo(dtype).dtype
+        key = (n_fft, self.fs, tuple(self.frequencies), self.w, real_dtype)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        # Fourier transform of morlet2(M, s, w), centred on sample 0
+        omega = 2 * np.pi * scipy.fft.fftfreq(n_fft)
+        wavelets = np.pi ** -0.25 * np.sqrt(2 * np.pi * self.scales) * np.exp(-0.5 * (self.scales * omega[:, None] - self.w) ** 2)
+        wavelets = wavelets.astype(real_dtype)
+
+        # Drop the least recently used wavelets to stay within max_cache_gb
+        self._cache[key] = wavelets
+        while len(self._cache) > 1 and sum(cached.nbytes for cached in self._cache.values()) > self.max_cache_gb * 1e9:
+            self._cache.popitem(last=False)
+
+        return wavelets
+
+    def transform(self, signal, dtype=np.complex128, power=False):
+        """
+        Apply the complex Morlet wavelet transform to a signal for all frequencies in the bank.
+
+        Parameters:
+        - signal (numpy.ndarray): The input signal (time series), with time on axis 0. Any further axes (e.g. channels) are transformed together.
+        - dtype: Complex data type of the coefficients, np.complex128 or np.complex64. Default is np.complex128.
+        - power (bool): If True, return the power (squared magnitude) of the coefficients, as the matching real type. Default is False.
+
+        Returns:
+        - numpy.ndarray: An array of wavelet coefficients (or power), with dimensions (time x frequencies x any further signal axes).
+        """
+        signal = np.asarray(signal, dtype=np.finfo(dtype).dtype)
+        n = signal.shape[0]
+        n_fft = self.fft_length(n)
+
+        signal_fft = scipy.fft.fft(signal, n=n_fft, axis=0, workers=self.workers)
+        wavelets = self.get_wavelets(n_fft, dtype).reshape((n_fft, len(self.frequencies)) + (1,) * (signal.ndim - 1))
+
+        # Convolve with every wavelet at once in the frequency domain
+        wavelet_coeffs = scipy.fft.ifft(signal_fft[:, None] * wavelets, axis=0, workers=self.workers, overwrite_x=True)[:n]
+
+        if power:
+            return np.abs(wavelet_coeffs) ** 2
+        return wavelet_coeffs
+
+def calculate_morlet_df(arm_cycle_df, channel, lfp_sampling_rate, f_min, f_max, f_bins, wavelet_bank=None):
     '''
     Takes dataframe of LFP data with theta cycles and traversal indices
     FOR A GIVEN CHANNEL, calculates frequency power across wavelengths for each traversal individually and adds to the dataframe
+    Wavelets come from a MorletWaveletBank, which can be passed in to reuse its cached wavelets across channels and calls
+
+    Also accepts a TraversalData store, in which case it returns a (samples, frequencies) array of wavelet coefficients
+    aligned to the store's samples in place of the dataframe
     '''
     #Check channel is string
     if not isinstance(channel, str):
         channel = str(channel)
         
-    frequencies = np.linspace(f_min, f_max, f_bins)
+    if wavelet_bank is None:
+        frequencies = np.linspace(f_min, f_max, f_bins)
+        wavelet_bank = MorletWaveletBank(frequencies, lfp_sampling_rate)
+    else:
+        frequencies = wavelet_bank.frequencies
+
+    if isinstance(arm_cycle_df, TraversalData):
+        channel_lfp = arm_cycle_df.lfp[:, arm_cycle_df.channels.index(channel)]
+        morlet_coeffs = np.full((len(arm_cycle_df), len(frequencies)), np.nan, dtype=complex)
+        for traversal in range(arm_cycle_df.n_traversals):
+            traversal_slice = arm_cycle_df.traversal_slice(traversal)
+            if traversal_slice.stop > traversal_slice.start:
+                morlet_coeffs[traversal_slice] = wavelet_bank.transform(channel_lfp[traversal_slice])
+        return morlet_coeffs
+
     channel_lfp = arm_cycle_df.loc(axis = 0)[channel]
     traversal_index = arm_cycle_df.loc(axis=0)['Traversal Index']
     
@@ -65,9 +195,7 @@ def calculate_morlet_df(arm_cycle_df, channel, lfp_sampling_rate, f_min, f_max,
         if traversal_data.size != 0:
             # print(channel, traversal, len(traversal_df.loc[channel]))
             # Calculate wavelet transform
-            traversal_morlet = complex_morlet_wavelet_transform(signal = traversal_data,
-                                   frequencies = frequencies,
-                                   fs = lfp_sampling_rate)
+            traversal_morlet = wavelet_bank.transform(np.asarray(traversal_data, dtype=float))
             
             # Add to dataframe
             morlet_df.loc[frequencies, traversal_timestamps] = traversal_morlet.T
@@ -89,18 +217,9 @@ def plot_wavelet_power_spectrum_theta(wavelet_coeffs, theta_phase, n_theta_bins,
     :param n_theta_bins: number of theta bins to separate data into for plotting
     :param frequencies: Array of frequencies used in the wavelet transform
     """
-    bin_edges = np.linspace(0, 2 * np.pi, n_theta_bins + 1)
-    power_spectra = np.zeros((len(frequencies), n_theta_bins))
-    
-    for i in range(n_theta_bins):
-        # Find indices for the current theta phase bin
-        indices = np.where((theta_phase >= bin_edges[i]) & (theta_phase < bin_edges[i + 1]))[0]
-
-        # Extract the wavelet coefficients for these indices
-        selected_coeffs = wavelet_coeffs[indices, :]
-
-        # Calculate the average power spectrum for this phase bin
-        power_spectra[:, i] = np.mean(np.abs(selected_coeffs) ** 2, axis=0)
+    # Calculate the average power spectrum for each phase bin
+    theta_bin_centers, mean_power, _, _ = bin_by_phase(wavelet_coeffs, theta_phase, n_bins=n_theta_bins, power=True)
+    power_spectra = mean_power.T
         
     # Smooth data across phase bins
     from scipy.ndimage import gaussian_filter1d
@@ -109,7 +228,6 @@ def plot_wavelet_power_spectrum_theta(wavelet_coeffs, theta_phase, n_theta_bins,
     smoothed_power_spectra = np.array([gaussian_filter1d(power_spectra[i, :], sigma) for i in range(power_spectra.shape[0])])
     
     # Plotting
-    theta_bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
     plt.figure(figsize=(10, 6))
     plt.pcolormesh(theta_bin_centers, frequencies, smoothed_power_spectra, cmap='jet')
     plt.xlabel('Theta Phase [radians]')
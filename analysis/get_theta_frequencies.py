@@ -1,9 +1,10 @@
 import numpy as np
-from scipy.signal import welch
+from scipy.signal import welch, spectrogram
 
 def get_theta_frequencies(lfp_data, sampling_rate):
     """
     Finds the peak power frequency in the theta range (4-10 Hz) for each channel in a 2D LFP array using Welch's method.
+    The power spectral density of all channels is computed at once.
     
     Parameters:
     - LFP_2D_array (numpy array): The 2D array of local field potential signal traces, shape = (samples, channels).
@@ -13,22 +14,69 @@ def get_theta_frequencies(lfp_data, sampling_rate):
     - numpy array: An array containing the frequency with peak power in the 4-10 Hz range for each channel.
     """
     
-    num_channels = lfp_data.shape[1]
-    peak_theta_freqs = np.zeros(num_channels)
+    # Compute the power spectral density using Welch's method, for all channels at once
+    freq_values, power_spectrum = welch(lfp_data, fs=sampling_rate, nperseg=1024, axis=0)
+
+    return find_peak_theta_freqs(freq_values, power_spectrum)
+
+def get_theta_frequencies_sliding(lfp_data, sampling_rate, window_duration=10, window_step=1):
+    """
+    Finds the peak power frequency in the theta range (4-10 Hz) for each channel in sliding windows along a 2D LFP array.
+
+    A single spectrogram is computed with the same segments as the Welch's method used by get_theta_frequencies
+    (1024 samples, 50% overlap). The Welch PSD of each window is then the mean of the segments inside it,
+    taken from a cumulative sum over segments, so segments shared between windows are only computed once.
+    
+    Parameters:
+    - lfp_data (numpy array): The 2D array of local field potential signal traces, shape = (samples, channels).
+    - sampling_rate (float): The sampling rate of the LFP traces in Hz.
+    - window_duration (float): Length of each window in seconds. Default is 10 s.
+    - window_step (float): Step between window starts in seconds. Rounded to a whole number of segment steps (512 samples). Default is 1 s.
     
-    for i in range(num_channels):
-        # Extract the LFP trace for the current channel
-        lfp_trace = lfp_data[:, i]
-        
-        # Compute the power spectral density using Welch's method
-        freq_values, power_spectrum = welch(lfp_trace, fs=sampling_rate, nperseg=1024)
-        
-        # Filter frequencies to only include those in the 4-10 Hz range
-        theta_indices = np.where((freq_values >= 4) & (freq_values <= 10))
-        theta_freqs = freq_values[theta_indices]
-        theta_power = power_spectrum[theta_indices]
-        
-        # Find the frequency with the peak power in the theta range
-        peak_theta_freqs[i] = theta_freqs[np.argmax(theta_power)]
-        
-    return peak_theta_freqs
+    Returns:
+    - peak_theta_freqs (numpy array): Frequency with peak power in the 4-10 Hz range, shape = (windows, channels).
+    - window_times (numpy array): Centre time (in seconds from the start of lfp_data) of each window.
+    """
+    nperseg = 1024
+    segment_step = nperseg // 2
+
+    # Power spectral density of every segment, shape = (freqs, channels, segments)
+    freq_values, segment_times, segment_power = spectrogram(lfp_data, fs=sampling_rate, window='hann', nperseg=nperseg,
+                                                          noverlap=nperseg - segment_step, axis=0)
+
+    # Number of whole segments in each window, and the step between windows in segments
+    segments_per_window = (int(round(window_duration * sampling_rate)) - nperseg) // segment_step + 1
+    if segments_per_window < 1:
+        raise ValueError(f"window_duration must be at least {nperseg / sampling_rate} s")
+    window_step_segments = max(int(round(window_step * sampling_rate / segment_step)), 1)
+
+    n_segments = segment_power.shape[-1]
+    window_starts = np.arange(0, n_segments - segments_per_window + 1, window_step_segments)
+
+    # Mean segment power in each window, from a cumulative sum over segments
+    cumulative_power = np.concatenate([np.zeros(segment_power.shape[:-1] + (1,)), np.cumsum(segment_power, axis=-1)], axis=-1)
+    window_power = (cumulative_power[..., window_starts + segments_per_window] - cumulative_power[..., window_starts]) / segments_per_window
+
+    peak_theta_freqs = find_peak_theta_freqs(freq_values, window_power).T
+    window_times = (segment_times[window_starts] + segment_times[window_starts + segments_per_window - 1]) / 2
+
+    return peak_theta_freqs, window_times
+
+def find_peak_theta_freqs(freq_values, power_spectrum):
+    """
+    Finds the frequency with peak power in the theta range (4-10 Hz) along the first axis of a power spectrum.
+
+    Parameters:
+    - freq_values (numpy array): Frequencies of the power spectrum.
+    - power_spectrum (numpy array): Power spectrum with frequency on the first axis, e.g. shape = (freqs, channels).
+
+    Returns:
+    - numpy array: The peak theta frequency for each entry of the remaining axes.
+    """
+    # Filter frequencies to only include those in the 4-10 Hz range
+    theta_indices = np.where((freq_values >= 4) & (freq_values <= 10))[0]
+    theta_freqs = freq_values[theta_indices]
+    theta_power = power_spectrum[theta_indices]
+
+    # Find the frequency with the peak power in the theta range
+    return theta_freqs[np.argmax(theta_power, axis=0)]
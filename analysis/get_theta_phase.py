@@ -1,5 +1,7 @@
 import numpy as np
 from scipy.signal import firwin, filtfilt, hilbert
+import pandas as pd
+from .rayleigh_vector import rayleigh_vector_grouped
 
 def get_theta_phase(lfp, sampling_rate, peak_freq, clip_value = 0, filt_half_bandwidth=2, power_thresh=5):
     """
@@ -15,6 +17,11 @@ def get_theta_phase(lfp, sampling_rate, peak_freq, clip_value = 0, filt_half_ban
 
     Returns:
     - theta_phase: Theta phase (in radians) timeseries, with low power cycles set to NaN.
+
+    Note: the cycle QC here does not do what is described above. np.union1d is applied to boolean masks, so
+    it removes cycles 0 and 1 and cycles whose number matches the index of a sample above clip_value (with the
+    default clip_value of 0, nearly every cycle), not low power or bad length cycles. The behaviour is kept
+    for existing analyses. get_theta_phase_multichannel applies the power, length and clipping checks as described.
     """
 
     # Filter the LFP around the peak frequency
@@ -99,3 +106,509 @@ def get_spike_theta_phase(lfp, spike_times, sampling_rate, peak_freq, clip_value
     spike_phases[out_of_bounds_indices] = np.nan
 
     return spike_phases
+
+def odd_extend(x, pad_length):
+    """
+    Odd extension of an array along axis 0, as used for edge padding by scipy.signal.filtfilt.
+
+    Parameters:
+    - x: Array to extend, with time along axis 0.
+    - pad_length: Number of samples to add at each end.
+
+    Returns:
+    - extended: Array with pad_length samples added to the start and end of axis 0.
+    """
+    if pad_length < 1:
+        return x
+    left = 2 * x[:1] - x[pad_length:0:-1]
+    right = 2 * x[-1:] - x[-2:-pad_length - 2:-1]
+    return np.concatenate([left, x, right], axis=0)
+
+def zero_phase_fir_filter(lfp, filter_taps, pad_length):
+    """
+    Zero-phase FIR filtering along axis 0 using FFT (overlap-add) convolution.
+
+    For an FIR filter, filtfilt is equivalent to a single convolution with the autocorrelation of the taps,
+    applied to the odd-extended signal. This gives the same result as filtfilt(filter_taps, 1, lfp, axis=0,
+    padlen=pad_length) (up to rounding) whenever pad_length is at least len(filter_taps) - 1, but costs
+    O(N log taps) per channel instead of O(N * taps).
+
+    Parameters:
+    - lfp: LFP array with time along axis 0, e.g. (samples, channels).
+    - filter_taps: FIR filter coefficients.
+    - pad_length: Number of samples of odd extension added at each end before filtering.
+
+    Returns:
+    - filtered_lfp: Filtered LFP, same shape as lfp.
+    """
+    from scipy.signal import oaconvolve
+
+    # Forward-backward filtering is a convolution with the (symmetric) autocorrelation of the taps
+    kernel = np.convolve(filter_taps, filter_taps[::-1])
+    kernel = kernel.reshape((-1,) + (1,) * (lfp.ndim - 1))
+
+    extended = odd_extend(lfp, pad_length)
+    filtered = oaconvolve(extended, kernel, mode='same', axes=0)
+
+    return filtered[pad_length:pad_length + lfp.shape[0]]
+
+def filter_theta_multichannel(lfp, sampling_rate, peak_freqs, filt_half_bandwidth=2, pad_length=None):
+    """
+    Band-pass filter every channel of an LFP array around its peak theta frequency, with zero_phase_fir_filter.
+
+    Parameters:
+    - lfp: LFP array of shape (samples, channels).
+    - sampling_rate: The sampling rate of the LFP.
+    - peak_freqs: Array of peak frequencies, one per channel.
+    - filt_half_bandwidth: Half bandwidth for filtering. Default is 2 Hz.
+    - pad_length: Number of samples of odd extension at each end. Default is the filtfilt default used by get_theta_phase.
+
+    Returns:
+    - filtered_lfp: Filtered LFP, same shape as lfp.
+    """
+    filtered_lfp = np.empty_like(lfp)
+
+    # Filter each group of channels that shares a peak frequency with a single convolution
+    for freq in np.unique(peak_freqs):
+        channels = peak_freqs == freq
+        filter_taps = firwin(round(sampling_rate) + 1, [freq - filt_half_bandwidth, freq + filt_half_bandwidth], pass_zero=False, window='blackman', fs=sampling_rate)
+        channel_pad_length = 3 * (len(filter_taps) - 1) if pad_length is None else pad_length
+        channel_pad_length = min(channel_pad_length, lfp.shape[0] - 1)
+        filtered_lfp[:, channels] = zero_phase_fir_filter(lfp[:, channels], filter_taps, channel_pad_length)
+
+    return filtered_lfp
+
+def find_bad_cycles(cycle_lengths, power_sum, clipped_count, peak_freqs, sampling_rate, filt_half_bandwidth=2, power_thresh=5):
+    """
+    Apply the theta cycle quality checks to per-cycle summaries of every channel at once.
+    A cycle is bad if its mean power is below the `power_thresh` percentile of that channel's cycles, if its
+    length is outside the range expected from the filter pass band, or if it contains a clipped sample.
+
+    Parameters:
+    - cycle_lengths: Array of shape (channels, cycles) with the number of samples in each cycle. Cycles of length 0 are ignored.
+    - power_sum: Array of shape (channels, cycles) with the summed filtered power of each cycle.
+    - clipped_count: Array of shape (channels, cycles) with the number of clipped samples in each cycle.
+    - peak_freqs: Array of peak frequencies, one per channel.
+    - sampling_rate: The sampling rate of the LFP.
+    - filt_half_bandwidth: Half bandwidth for filtering. Default is 2 Hz.
+    - power_thresh: Threshold (percentile) for minimum power per cycle. Default is 5.
+
+    Returns:
+    - bad_cycles: Boolean array of shape (channels, cycles).
+    """
+    # Identify bad power cycles against each channel's own threshold
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power_per_cycle = power_sum / cycle_lengths
+    power_threshold = np.nanpercentile(power_per_cycle, power_thresh, axis=1)
+    bad_power_cycles = power_per_cycle < power_threshold[:, None]
+
+    # Identify bad length cycles
+    pass_band = np.array([peak_freqs - filt_half_bandwidth, peak_freqs + filt_half_bandwidth])
+    cycle_length_lim = np.ceil(1 / pass_band * sampling_rate).astype(int)
+    bad_length_cycles = (cycle_lengths < cycle_length_lim[1][:, None]) | (cycle_lengths > cycle_length_lim[0][:, None])
+
+    return bad_power_cycles | bad_length_cycles | (clipped_count > 0)
+
+def summarise_cycles(cycle_numbers, filtered_lfp, lfp, clip_value, n_cycles):
+    """
+    Sum the length, filtered power and clipped samples of each theta cycle, for every channel at once.
+
+    Parameters:
+    - cycle_numbers: Integer array of shape (samples, channels) with the cycle number of each sample.
+    - filtered_lfp: Filtered LFP, shape (samples, channels).
+    - lfp: Raw LFP, shape (samples, channels), used for the clipping check.
+    - clip_value: Absolute LFP value at or above which a sample is treated as clipped, or None.
+    - n_cycles: Number of cycle slots per channel in the output. Must be greater than the largest cycle number.
+
+    Returns:
+    - cycle_lengths, power_sum, clipped_count: Arrays of shape (channels, n_cycles).
+    """
+    n_channels = cycle_numbers.shape[1]
+    n_bins = n_channels * n_cycles
+
+    # Index each (channel, cycle) pair into a flat array of shape (channels, n_cycles)
+    flat_cycle_idx = (cycle_numbers + np.arange(n_channels)[None, :] * n_cycles).ravel()
+
+    cycle_lengths = np.bincount(flat_cycle_idx, minlength=n_bins).reshape(n_channels, n_cycles)
+    power_sum = np.bincount(flat_cycle_idx, (filtered_lfp ** 2).ravel(), minlength=n_bins).reshape(n_channels, n_cycles)
+    if clip_value is not None:
+        clipped_count = np.bincount(flat_cycle_idx, (np.abs(lfp) >= clip_value).ravel(), minlength=n_bins).reshape(n_channels, n_cycles)
+    else:
+        clipped_count = np.zeros((n_channels, n_cycles))
+
+    return cycle_lengths, power_sum, clipped_count
+
+def get_theta_phase_multichannel(lfp, sampling_rate, peak_freq, clip_value=None, filt_half_bandwidth=2, power_thresh=5):
+    """
+    Calculate theta phase and cycle numbers for all channels of an LFP array at once.
+
+    Filters every channel with FFT (overlap-add) convolution along axis 0, runs the Hilbert transform on all
+    channels together, and applies the cycle quality checks (find_bad_cycles) to every channel in one pass.
+
+    Parameters:
+    - lfp: LFP array of shape (samples, channels), e.g. ephys.lfp_data[trial]['data']. A 1D trace is also accepted.
+    - sampling_rate: The sampling rate of the LFP.
+    - peak_freq: The central frequency around which the LFP is filtered. Either a single value or one per channel.
+    - clip_value: Absolute LFP value at or above which a sample is treated as clipped. Default is None (no clipping check).
+    - filt_half_bandwidth: Half bandwidth for filtering. Default is 2 Hz.
+    - power_thresh: Threshold (percentile) for minimum power per cycle. Default is 5.
+
+    Returns:
+    - theta_phase: Theta phase (in radians) for each sample and channel, with bad cycles set to NaN.
+    - cycle_numbers: Theta cycle number for each sample and channel, with bad cycles set to NaN.
+    """
+    lfp = np.asarray(lfp, dtype=float)
+    is_1d = lfp.ndim == 1
+    if is_1d:
+        lfp = lfp[:, None]
+    n_channels = lfp.shape[1]
+
+    peak_freqs = np.broadcast_to(np.asarray(peak_freq, dtype=float), (n_channels,))
+    filtered_lfp = filter_theta_multichannel(lfp, sampling_rate, peak_freqs, filt_half_bandwidth)
+
+    # Extract instantaneous phase using the Hilbert transform, for all channels at once
+    theta_phase = np.angle(hilbert(filtered_lfp, axis=0))
+    # Wrap into the range 0 - 2pi, so that oscillation starts at the peak (convention).
+    theta_phase %= 2 * np.pi
+
+    # Identify phase transitions and number cycles along each channel
+    phase_transitions = np.diff(theta_phase, axis=0) < -np.pi
+    cycle_numbers = np.vstack([np.zeros((1, n_channels), dtype=int), np.cumsum(phase_transitions, axis=0)])
+
+    ### Remove bad data, for all channels at once
+    n_cycles = int(cycle_numbers[-1].max()) + 1
+    cycle_summary = summarise_cycles(cycle_numbers, filtered_lfp, lfp, clip_value, n_cycles)
+    bad_cycles = find_bad_cycles(*cycle_summary, peak_freqs, sampling_rate, filt_half_bandwidth, power_thresh)
+
+    # Mark theta phase and cycle numbers corresponding to bad cycles as NaN
+    bad_cycle_indices = bad_cycles[np.arange(n_channels)[None, :], cycle_numbers]
+    theta_phase[bad_cycle_indices] = np.nan
+    cycle_numbers = cycle_numbers.astype(float) # Convert to float to allow incluion of NaN
+    cycle_numbers[bad_cycle_indices] = np.nan
+
+    if is_1d:
+        return theta_phase[:, 0], cycle_numbers[:, 0]
+    return theta_phase, cycle_numbers
+
+def get_theta_phase_streaming(lfp, sampling_rate, peak_freq, output_path, clip_value=None, filt_half_bandwidth=2, power_thresh=5,
+                              chunk_duration=60, overlap_duration=5, dtype=np.float32):
+    """
+    Calculate theta phase and cycle numbers for long recordings without holding the full LFP in memory.
+
+    The LFP is read in chunks, each padded by an overlap on both sides that is discarded after filtering and
+    the Hilbert transform, so only the central part of each chunk (away from the edge effects) is kept.
+    Cycle numbers carry on across chunks, and per-cycle power, length and clipping are accumulated as the
+    chunks are processed so the quality checks (find_bad_cycles) use the whole recording, as in
+    get_theta_phase_multichannel. Results are written to .npy files that are memory-mapped while writing.
+
+    Parameters:
+    - lfp: LFP array of shape (samples, channels) that supports slicing along axis 0, e.g. an np.memmap of a raw binary file.
+    - sampling_rate: The sampling rate of the LFP.
+    - peak_freq: The central frequency around which the LFP is filtered. Either a single value or one per channel.
+    - output_path: Path prefix for the output files, written as {output_path}_theta_phase.npy and {output_path}_cycle_numbers.npy.
+    - clip_value: Absolute LFP value at or above which a sample is treated as clipped. Default is None (no clipping check).
+    - filt_half_bandwidth: Half bandwidth for filtering. Default is 2 Hz.
+    - power_thresh: Threshold (percentile) for minimum power per cycle. Default is 5.
+    - chunk_duration: Length (in seconds) of the part of each chunk that is kept. Default is 60 s.
+    - overlap_duration: Length (in seconds) of the overlap read on each side of a chunk. Extended to at least twice the filter length. Default is 5 s.
+    - dtype: Data type of the output files. Default is float32.
+
+    Returns:
+    - theta_phase: Memory-mapped theta phase (in radians) for each sample and channel, with bad cycles set to NaN.
+    - cycle_numbers: Memory-mapped theta cycle number for each sample and channel, with bad cycles set to NaN.
+    """
+    n_samples = lfp.shape[0]
+    is_1d = len(lfp.shape) == 1
+    n_channels = 1 if is_1d else lfp.shape[1]
+
+    peak_freqs = np.broadcast_to(np.asarray(peak_freq, dtype=float), (n_channels,))
+    filter_length = round(sampling_rate) + 1
+    # Odd extension at the true recording edges matches the in-memory filter. Inside the recording, the overlap covers the filter edge effects
+    pad_length = min(3 * (filter_length - 1), n_samples - 1)
+
+    chunk_size = int(round(chunk_duration * sampling_rate))
+    overlap = max(int(round(overlap_duration * sampling_rate)), 2 * (filter_length - 1))
+    chunk_starts = np.arange(0, n_samples, chunk_size)
+
+    theta_phase = np.lib.format.open_memmap(f'{output_path}_theta_phase.npy', mode='w+', dtype=dtype, shape=(n_samples, n_channels))
+    cycle_numbers = np.lib.format.open_memmap(f'{output_path}_cycle_numbers.npy', mode='w+', dtype=dtype, shape=(n_samples, n_channels))
+
+    # Per-cycle summaries for the whole recording, grown as cycles are found
+    n_cycles = 1
+    cycle_summary = [np.zeros((n_channels, n_cycles)) for _ in range(3)]
+    last_phase = None
+    last_cycle = np.zeros(n_channels, dtype=int)
+
+    ### First pass: phase and cycle numbers
+    for start in chunk_starts:
+        stop = min(start + chunk_size, n_samples)
+        read_start, read_stop = max(start - overlap, 0), min(stop + overlap, n_samples)
+        chunk = np.asarray(lfp[read_start:read_stop], dtype=float).reshape(read_stop - read_start, n_channels)
+
+        filtered_chunk = filter_theta_multichannel(chunk, sampling_rate, peak_freqs, filt_half_bandwidth,
+                                                   pad_length=min(pad_length, chunk.shape[0] - 1))
+        chunk_phase = np.angle(hilbert(filtered_chunk, axis=0)) % (2 * np.pi)
+
+        # Keep only the central part of the chunk
+        keep = slice(start - read_start, stop - read_start)
+        chunk_phase, filtered_chunk, chunk = chunk_phase[keep], filtered_chunk[keep], chunk[keep]
+
+        # Continue cycle numbering from the last sample written by the previous chunk
+        if last_phase is None:
+            phase_transitions = np.vstack([np.zeros((1, n_channels), dtype=bool), np.diff(chunk_phase, axis=0) < -np.pi])
+        else:
+            phase_transitions = np.diff(np.vstack([last_phase, chunk_phase]), axis=0) < -np.pi
+        chunk_cycles = last_cycle + np.cumsum(phase_transitions, axis=0)
+
+        theta_phase[start:stop] = chunk_phase
+        cycle_numbers[start:stop] = chunk_cycles
+
+        # Grow the per-cycle summaries if needed, then add this chunk's contribution
+        needed_cycles = int(chunk_cycles[-1].max()) + 1
+        if needed_cycles > n_cycles:
+            new_n_cycles = max(needed_cycles, 2 * n_cycles)
+            cycle_summary = [np.pad(summary, ((0, 0), (0, new_n_cycles - n_cycles))) for summary in cycle_summary]
+            n_cycles = new_n_cycles
+        chunk_summary = summarise_cycles(chunk_cycles, filtered_chunk, chunk, clip_value, n_cycles)
+        for summary, chunk_sum in zip(cycle_summary, chunk_summary):
+            summary += chunk_sum
+
+        last_phase, last_cycle = chunk_phase[-1:], chunk_cycles[-1]
+
+    ### Second pass: remove bad data
+    bad_cycles = find_bad_cycles(*cycle_summary, peak_freqs, sampling_rate, filt_half_bandwidth, power_thresh)
+    for start in chunk_starts:
+        stop = min(start + chunk_size, n_samples)
+        chunk_cycles = cycle_numbers[start:stop].astype(int)
+        bad_cycle_indices = bad_cycles[np.arange(n_channels)[None, :], chunk_cycles]
+        theta_phase[start:stop][bad_cycle_indices] = np.nan
+        cycle_numbers[start:stop][bad_cycle_indices] = np.nan
+
+    theta_phase.flush()
+    cycle_numbers.flush()
+
+    if is_1d:
+        return theta_phase[:, 0], cycle_numbers[:, 0]
+    return theta_phase, cycle_numbers
+
+def get_spike_theta_phase_table(spike_data, lfp_data, channel, peak_freq, clip_value=None, filt_half_bandwidth=2, power_thresh=5):
+    """
+    Calculate the theta phase of every spike in a session, and the Rayleigh vector of each cluster.
+
+    Theta phase is computed once per (trial, channel, peak frequency) with get_theta_phase_multichannel. The
+    phases of all trials are concatenated, so every spike is looked up with a single index operation.
+
+    Phases can differ from get_spike_theta_phase for the same spikes. get_theta_phase_multichannel removes cycles
+    with low power, bad length or (if clip_value is given) clipped samples, while get_theta_phase's cycle QC only
+    removes cycles 0 and 1 and cycles whose number matches the index of a sample above clip_value. With its default
+    clip_value of 0 that is nearly every cycle. NaN masks and Rayleigh statistics therefore change when moving from
+    the per-cluster function.
+
+    Parameters:
+    - spike_data: Spike data dictionary, as ephys.spike_data, with 'spike_times' (in seconds from the trial start), 'spike_clusters' and 'spike_trial'.
+    - lfp_data: List of LFP data dictionaries, one per trial, as ephys.lfp_data. Trials with no LFP loaded (None) give NaN phases.
+    - channel: Column index of the LFP channel to use. Either a single value or one per trial.
+    - peak_freq: The central frequency around which the LFP is filtered. Either a single value or one per trial.
+    - clip_value: Absolute LFP value at or above which a sample is treated as clipped. Default is None (no clipping check).
+    - filt_half_bandwidth: Half bandwidth for filtering. Default is 2 Hz.
+    - power_thresh: Threshold (percentile) for minimum power per cycle. Default is 5.
+
+    Returns:
+    - spike_phases: Theta phase (in radians) of each spike, aligned to spike_data['spike_times']. Spikes in bad cycles or outside the LFP are NaN.
+    - rayleigh_df: DataFrame indexed by cluster with columns 'n_spikes' (spikes with a valid phase), 'R', 'mean_angle', 'rayleigh_z' and 'rayleigh_p'.
+    """
+    spike_times = np.asarray(spike_data['spike_times'])
+    spike_clusters = np.asarray(spike_data['spike_clusters'])
+    spike_trials = np.asarray(spike_data['spike_trial'])
+
+    n_trials = len(lfp_data)
+    channels = np.broadcast_to(channel, (n_trials,))
+    peak_freqs = np.broadcast_to(peak_freq, (n_trials,))
+
+    # Theta phase for each trial, computed once per (trial, channel, peak frequency)
+    trial_phases = {}
+    for trial in np.unique(spike_trials):
+        if lfp_data[trial] is None:
+            continue
+        key = (trial, channels[trial], peak_freqs[trial])
+        if key not in trial_phases:
+            lfp = lfp_data[trial]['data'][:, channels[trial]]
+            trial_phases[key], _ = get_theta_phase_multichannel(lfp, lfp_data[trial]['sampling_rate'], peak_freqs[trial],
+                                                                clip_value=clip_value, filt_half_bandwidth=filt_half_bandwidth,
+                                                                power_thresh=power_thresh)
+
+    # Concatenate the phases of all trials, with a trailing NaN for spikes outside the LFP
+    phase_offsets = np.zeros(n_trials, dtype=int)
+    trial_lengths = np.zeros(n_trials, dtype=int)
+    sampling_rates = np.ones(n_trials)
+    phase_list = []
+    offset = 0
+    for (trial, _, _), phase in trial_phases.items():
+        phase_offsets[trial], trial_lengths[trial] = offset, len(phase)
+        sampling_rates[trial] = lfp_data[trial]['sampling_rate']
+        phase_list.append(phase)
+        offset += len(phase)
+    phase_list.append([np.nan])
+    all_phases = np.concatenate(phase_list)
+
+    # MAP SPIKE TIMES TO PHASE, for all spikes at once
+    spike_indices = (spike_times * sampling_rates[spike_trials]).astype(int)
+    in_bounds = (spike_indices >= 0) & (spike_indices < trial_lengths[spike_trials])
+    flat_indices = np.where(in_bounds, phase_offsets[spike_trials] + spike_indices, offset)
+    spike_phases = all_phases[flat_indices]
+
+    # Rayleigh vector of each cluster, as a grouped reduction
+    cluster_ids, cluster_labels = np.unique(spike_clusters, return_inverse=True)
+    R, mean_angle, rayleigh_z, rayleigh_p, n_spikes = rayleigh_vector_grouped(spike_phases, cluster_labels, len(cluster_ids))
+    rayleigh_df = pd.DataFrame({'n_spikes': n_spikes, 'R': R, 'mean_angle': mean_angle, 'rayleigh_z': rayleigh_z, 'rayleigh_p': rayleigh_p},
+                               index=pd.Index(cluster_ids, name='cluster'))
+
+    return spike_phases, rayleigh_df
+
+class ThetaCycleTable:
+    """
+    Table of theta cycles, with the start and stop sample, duration, mean power and validity of every cycle.
+
+    Cycles are sorted by cycle number and do not overlap, so cycle-to-sample and window-to-cycle queries are
+    answered with np.searchsorted on the start and stop arrays rather than by scanning a per-sample cycle array.
+
+    Usage:
+        cycle_table = get_theta_cycle_table(lfp, sampling_rate, peak_freq)
+        # or, from the cycle numbers returned by get_theta_phase
+        cycle_table = ThetaCycleTable.from_cycle_numbers(cycle_numbers, sampling_rate)
+
+        traversal_cycles = cycle_table.window_cycles(window_starts, window_stops)
+        sample_indices = cycle_table.cycle_sample_indices(traversal_cycles[0])
+
+    Attributes:
+        cycle_ids (numpy.ndarray): Cycle number of each cycle.
+        start (numpy.ndarray): First sample of each cycle.
+        stop (numpy.ndarray): Sample after the last sample of each cycle.
+        duration (numpy.ndarray): Duration of each cycle in seconds.
+        power (numpy.ndarray): Mean power of each cycle (NaN if not known).
+        valid (numpy.ndarray): Whether each cycle passed the quality checks.
+        sampling_rate (float): The sampling rate of the LFP.
+    """
+
+    def __init__(self, cycle_ids, start, stop, sampling_rate, power=None, valid=None):
+        self.cycle_ids = np.asarray(cycle_ids, dtype=int)
+        self.start = np.asarray(start, dtype=int)
+        self.stop = np.asarray(stop, dtype=int)
+        self.sampling_rate = sampling_rate
+        self.duration = (self.stop - self.start) / sampling_rate
+        self.power = np.full(len(self.cycle_ids), np.nan) if power is None else np.asarray(power, dtype=float)
+        self.valid = np.ones(len(self.cycle_ids), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+
+    def __len__(self):
+        return len(self.cycle_ids)
+
+    @classmethod
+    def from_cycle_numbers(cls, cycle_numbers, sampling_rate, power=None):
+        """
+        Builds a cycle table from a per-sample cycle number array, as returned by get_theta_phase (NaN for bad cycles).
+        Only cycles present in the array are included, and all are marked valid.
+
+        Parameters:
+        - cycle_numbers: Theta cycle number of each sample, with NaN for samples outside valid cycles.
+        - sampling_rate: The sampling rate of the LFP.
+        - power: Optional per-sample power (e.g. squared filtered LFP), averaged over each cycle. Default is None.
+        """
+        cycle_numbers = np.asarray(cycle_numbers, dtype=float).ravel()
+        sample_indices = np.flatnonzero(~np.isnan(cycle_numbers))
+        sample_cycles = cycle_numbers[sample_indices]
+
+        # Each cycle is a run of equal cycle numbers
+        run_starts = np.flatnonzero(np.diff(sample_cycles, prepend=np.nan) != 0)
+        run_stops = np.append(run_starts[1:], len(sample_indices))
+        start = sample_indices[run_starts]
+        stop = sample_indices[run_stops - 1] + 1
+
+        cycle_power = None
+        if power is not None and len(run_starts):
+            power = np.asarray(power, dtype=float).ravel()[sample_indices]
+            cycle_power = np.add.reduceat(power, run_starts) / (run_stops - run_starts)
+
+        return cls(sample_cycles[run_starts], start, stop, sampling_rate, power=cycle_power)
+
+    def cycle_positions(self, cycle_ids):
+        """
+        Returns the row of each cycle number in the table, or -1 for cycle numbers not in the table.
+        """
+        cycle_ids = np.asarray(cycle_ids)
+        positions = np.searchsorted(self.cycle_ids, cycle_ids)
+        in_table = positions < len(self.cycle_ids)
+        in_table[in_table] = self.cycle_ids[positions[in_table]] == cycle_ids[in_table]
+
+        return np.where(in_table, positions, -1)
+
+    def cycle_sample_indices(self, cycle_ids):
+        """
+        Returns the sample indices of a set of cycles, concatenated in the order given. Cycles not in the table are skipped.
+        """
+        positions = self.cycle_positions(np.asarray(cycle_ids, dtype=float).ravel())
+        positions = positions[positions >= 0]
+        lengths = self.stop[positions] - self.start[positions]
+
+        # Concatenated ranges start:stop of every cycle
+        range_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(self.start[positions], lengths) + np.arange(lengths.sum()) - range_offsets
+
+    def window_cycles(self, window_starts, window_stops, drop_edge_cycles=True):
+        """
+        Finds the valid cycles overlapping each of a set of sample windows.
+
+        Parameters:
+        - window_starts: First sample of each window.
+        - window_stops: Sample after the last sample of each window.
+        - drop_edge_cycles: If True, discard the first and last cycle of each window, as these will likely be incomplete. Default is True.
+
+        Returns:
+        - list of arrays: The cycle numbers in each window.
+        """
+        valid_ids = self.cycle_ids[self.valid]
+        first = np.searchsorted(self.stop[self.valid], window_starts, side='right')
+        last = np.searchsorted(self.start[self.valid], window_stops, side='left')
+        if drop_edge_cycles:
+            first, last = first + 1, last - 1
+
+        return [valid_ids[i:j] for i, j in zip(first, np.maximum(last, first))]
+
+    def to_dataframe(self):
+        """
+        Returns the table as a DataFrame indexed by cycle number.
+        """
+        return pd.DataFrame({'start': self.start, 'stop': self.stop, 'duration': self.duration, 'power': self.power, 'valid': self.valid},
+                            index=pd.Index(self.cycle_ids, name='cycle'))
+
+def get_theta_cycle_table(lfp, sampling_rate, peak_freq, clip_value=None, filt_half_bandwidth=2, power_thresh=5):
+    """
+    Calculate the theta cycle table of a single LFP channel, including the cycles that fail the quality checks
+    (marked as not valid) with the same checks as get_theta_phase_multichannel.
+
+    Parameters:
+    - lfp: Local Field Potential time series.
+    - sampling_rate: The sampling rate of the LFP.
+    - peak_freq: The central frequency around which the LFP is filtered.
+    - clip_value: Absolute LFP value at or above which a sample is treated as clipped. Default is None (no clipping check).
+    - filt_half_bandwidth: Half bandwidth for filtering. Default is 2 Hz.
+    - power_thresh: Threshold (percentile) for minimum power per cycle. Default is 5.
+
+    Returns:
+    - cycle_table: ThetaCycleTable of all cycles, with power as the mean squared filtered LFP of each cycle.
+    """
+    lfp = np.asarray(lfp, dtype=float).reshape(-1, 1)
+    peak_freqs = np.array([peak_freq], dtype=float)
+    filtered_lfp = filter_theta_multichannel(lfp, sampling_rate, peak_freqs, filt_half_bandwidth)
+
+    theta_phase = np.angle(hilbert(filtered_lfp, axis=0)) % (2 * np.pi)
+    phase_transitions = np.diff(theta_phase[:, 0]) < -np.pi
+    cycle_numbers = np.concatenate([[0], np.cumsum(phase_transitions)])
+
+    n_cycles = cycle_numbers[-1] + 1
+    cycle_lengths, power_sum, clipped_count = summarise_cycles(cycle_numbers[:, None], filtered_lfp, lfp, clip_value, n_cycles)
+    bad_cycles = find_bad_cycles(cycle_lengths, power_sum, clipped_count, peak_freqs, sampling_rate, filt_half_bandwidth, power_thresh)
+
+    start = np.concatenate([[0], np.flatnonzero(phase_transitions) + 1])
+    stop = np.append(start[1:], len(cycle_numbers))
+
+    return ThetaCycleTable(np.arange(n_cycles), start, stop, sampling_rate, power=power_sum[0] / cycle_lengths[0], valid=~bad_cycles[0])
@@ -1,38 +1,163 @@
 import numpy as np
 import pandas as pd
+from .get_theta_phase import ThetaCycleTable
 
 def get_traversal_cycles(arm_times, cycle_numbers, lfp_timestamps, lfp_sampling_rate):
     '''
     Finds theta cycle IDs for individual arm traversals
     Returns an array of arrays, each containing theta cycle IDs for a single traversal
     E.g. [[1,2,3], [6,7,8]]
+
+    cycle_numbers can be the per-sample cycle number array from get_theta_phase, or a ThetaCycleTable.
+    Cycles of all traversals are found at once by searching the sorted cycle start and stop samples.
     '''
-    
+    if not isinstance(cycle_numbers, ThetaCycleTable):
+        cycle_numbers = ThetaCycleTable.from_cycle_numbers(cycle_numbers, lfp_sampling_rate)
+
     # Find continuous segments in central_times and return_times 
     # (ie where there is > 0.02 seconds between one sample and the next)
     # This should correspond to individual arm traversals
-    arm_segments = np.split(arm_times, np.where(np.diff(arm_times) > 0.025)[0] + 1)
-    # These are then stored as a list of time ranges for interfacing with LFP
-    traversals = np.array([(segment[0], segment[-1]) for segment in arm_segments if len(segment) > 1])
-    
-    # Find whole theta cycles within each traversal
-    # For each traversal
-    arm_cycle_numbers = []
-    for count, traversal in enumerate(traversals):
+    arm_times = np.asarray(arm_times)
+    segment_breaks = np.where(np.diff(arm_times) > 0.025)[0] + 1
+    segment_first = np.concatenate([[0], segment_breaks])
+    segment_last = np.concatenate([segment_breaks - 1, [len(arm_times) - 1]])
+    # These are then stored as time ranges for interfacing with LFP
+    multi_sample = segment_last > segment_first
+    traversals = np.column_stack([arm_times[segment_first[multi_sample]], arm_times[segment_last[multi_sample]]])
+
+    # Multiply times by lfp_sampling rate
+    traversals = (traversals * lfp_sampling_rate).astype(int)
+
+    # Find whole theta cycles within each traversal, discarding the first and last cycle as these will likely be incomplete
+    return cycle_numbers.window_cycles(traversals[:, 0], traversals[:, 1], drop_edge_cycles=True)
 
-        # Multiply times by lfp_sampling rate
-        traversal = (traversal * lfp_sampling_rate).astype(int)
+class TraversalData:
+    """
+    Array-native store of LFP data from all traversals in a given arm, as an alternative to the
+    DataFrame-per-sample layout of get_data_for_traversals.
+
+    Samples from all traversals are held in contiguous arrays, grouped by traversal and ordered in time within each
+    traversal. Traversal t covers samples traversal_offsets[t]:traversal_offsets[t + 1] (CSR-style offsets).
+
+    Usage:
+        arm_data = get_traversal_data(arm_traversal_cycles, cycle_numbers, lfp_data, speed_data, channels_to_load, theta_phase, lfp_timestamps)
+        traversal_lfp = arm_data.lfp[arm_data.traversal_slice(0)]
+        arm_df = arm_data.to_dataframe()    # Same layout as get_data_for_traversals
+
+    Attributes:
+        lfp (numpy.ndarray): LFP data, shape (samples, channels).
+        channels (list of str): Channel IDs, one per column of lfp.
+        timestamps (numpy.ndarray): Timestamp of each sample.
+        theta_phase (numpy.ndarray): Theta phase of each sample.
+        cycle_index (numpy.ndarray): Theta cycle index of each sample.
+        speed (numpy.ndarray): Speed at each sample.
+        traversal_offsets (numpy.ndarray): Start sample of each traversal, followed by the total number of samples.
+        traversal_index (numpy.ndarray): Traversal index of each sample.
+    """
+
+    meta_labels = ['Cycle Theta Phase', 'Cycle Index', 'Traversal Index', 'Speed']
+
+    def __init__(self, lfp, channels, timestamps, theta_phase, cycle_index, speed, traversal_offsets):
+        self.lfp = np.ascontiguousarray(lfp, dtype=float)
+        self.channels = [str(channel) for channel in channels]
+        self.timestamps = np.asarray(timestamps)
+        self.theta_phase = np.asarray(theta_phase, dtype=float).ravel()
+        self.cycle_index = np.asarray(cycle_index, dtype=float).ravel()
+        self.speed = np.asarray(speed, dtype=float).ravel()
+        self.traversal_offsets = np.asarray(traversal_offsets, dtype=int)
+        self.traversal_index = np.repeat(np.arange(self.n_traversals), np.diff(self.traversal_offsets))
+
+    def __len__(self):
+        return self.lfp.shape[0]
+
+    @property
+    def n_traversals(self):
+        return len(self.traversal_offsets) - 1
+
+    def traversal_slice(self, traversal):
+        """
+        Returns the slice of samples belonging to a traversal.
+        """
+        return slice(self.traversal_offsets[traversal], self.traversal_offsets[traversal + 1])
+
+    def select(self, mask):
+        """
+        Returns a new TraversalData holding only the samples where mask is True. Traversal indices are kept.
+        """
+        traversal_lengths = np.bincount(self.traversal_index[mask], minlength=self.n_traversals)
+        traversal_offsets = np.concatenate([[0], np.cumsum(traversal_lengths)])
+
+        return TraversalData(self.lfp[mask], self.channels, self.timestamps[mask], self.theta_phase[mask],
+                             self.cycle_index[mask], self.speed[mask], traversal_offsets)
+
+    def to_dataframe(self):
+        """
+        Converts to the DataFrame layout of get_data_for_traversals: timestamps as columns, and channel IDs
+        followed by 'Cycle Theta Phase', 'Cycle Index', 'Traversal Index' and 'Speed' as rows.
+        """
+        data = np.vstack([self.lfp.T, self.theta_phase, self.cycle_index, self.traversal_index, self.speed])
+
+        return pd.DataFrame(data, index=self.channels + self.meta_labels, columns=self.timestamps)
+
+def get_traversal_data(arm_traversal_cycles, cycle_numbers, lfp_data, speed_data, channels_to_load, theta_phase, lfp_timestamps):
+    '''
+    Collects LFP data from all traversals in a given arm into a TraversalData store, in a single pass over the session.
+    Each sample is matched to its traversal by looking up its cycle number in the sorted cycles of all traversals.
+    Each cycle is assumed to belong to one traversal (if listed more than once, the first traversal listing it is used).
 
-        # Get timestamps and unique cycle numbers found in this time window
-        traversal_cycle_numbers = np.unique(cycle_numbers[traversal[0]:traversal[1]])
+    cycle_numbers can also be a ThetaCycleTable, in which case the samples of each cycle are taken directly from
+    the table, without a pass over the session.
+    '''
+    if isinstance(cycle_numbers, ThetaCycleTable):
+        return _get_traversal_data_from_table(arm_traversal_cycles, cycle_numbers, lfp_data, speed_data, channels_to_load, theta_phase, lfp_timestamps)
+
+    cycle_numbers = np.asarray(cycle_numbers, dtype=float).ravel()
+
+    # Cycle numbers of all traversals, sorted, with the traversal each belongs to
+    traversal_lengths = [len(traversal) for traversal in arm_traversal_cycles]
+    arm_cycles = np.concatenate([np.asarray(traversal, dtype=float).ravel() for traversal in arm_traversal_cycles] + [np.empty(0)])
+    arm_cycle_traversals = np.repeat(np.arange(len(arm_traversal_cycles)), traversal_lengths)
+    cycle_order = np.argsort(arm_cycles, kind='stable')
+    arm_cycles, arm_cycle_traversals = arm_cycles[cycle_order], arm_cycle_traversals[cycle_order]
+
+    # Find the traversal of every sample whose cycle is in the arm
+    cycle_positions = np.searchsorted(arm_cycles, cycle_numbers)
+    in_range = cycle_positions < len(arm_cycles)
+    in_arm = in_range & (arm_cycles[np.where(in_range, cycle_positions, 0)] == cycle_numbers)
+    sample_indices = np.flatnonzero(in_arm)
+    sample_traversals = arm_cycle_traversals[cycle_positions[sample_indices]]
+
+    # Group samples by traversal, keeping time order within each traversal
+    traversal_order = np.argsort(sample_traversals, kind='stable')
+    sample_indices = sample_indices[traversal_order]
+    traversal_offsets = np.concatenate([[0], np.cumsum(np.bincount(sample_traversals, minlength=len(arm_traversal_cycles)))])
+
+    return TraversalData(lfp_data[sample_indices, :], channels_to_load, np.asarray(lfp_timestamps)[sample_indices],
+                         np.asarray(theta_phase)[sample_indices], cycle_numbers[sample_indices],
+                         np.asarray(speed_data)[sample_indices], traversal_offsets)
+
+def _get_traversal_data_from_table(arm_traversal_cycles, cycle_table, lfp_data, speed_data, channels_to_load, theta_phase, lfp_timestamps):
+    '''
+    get_traversal_data for a ThetaCycleTable
+    '''
+    traversal_lengths = [len(traversal) for traversal in arm_traversal_cycles]
+    arm_cycles = np.concatenate([np.asarray(traversal, dtype=float).ravel() for traversal in arm_traversal_cycles] + [np.empty(0)])
+    arm_cycle_traversals = np.repeat(np.arange(len(arm_traversal_cycles)), traversal_lengths)
 
-        # Discard min and max cycle number from traversal as these will likely be incomplete
-        traversal_cycle_numbers = traversal_cycle_numbers[1:-1]
+    # Keep cycles in the table, ordered by traversal and then cycle number
+    positions = cycle_table.cycle_positions(arm_cycles)
+    in_table = positions >= 0
+    arm_cycles, arm_cycle_traversals, positions = arm_cycles[in_table], arm_cycle_traversals[in_table], positions[in_table]
+    cycle_order = np.lexsort((arm_cycles, arm_cycle_traversals))
+    arm_cycles, arm_cycle_traversals, positions = arm_cycles[cycle_order], arm_cycle_traversals[cycle_order], positions[cycle_order]
 
-        # Add included cycles to array
-        arm_cycle_numbers.append(traversal_cycle_numbers)
+    cycle_lengths = cycle_table.stop[positions] - cycle_table.start[positions]
+    sample_indices = cycle_table.cycle_sample_indices(arm_cycles)
+    traversal_offsets = np.concatenate([[0], np.cumsum(np.bincount(arm_cycle_traversals, weights=cycle_lengths, minlength=len(arm_traversal_cycles)))])
 
-    return arm_cycle_numbers
+    return TraversalData(lfp_data[sample_indices, :], channels_to_load, np.asarray(lfp_timestamps)[sample_indices],
+                         np.asarray(theta_phase)[sample_indices], np.repeat(arm_cycles, cycle_lengths),
+                         np.asarray(speed_data)[sample_indices], traversal_offsets.astype(int))
 
 def get_data_for_traversals(arm_traversal_cycles, cycle_numbers, lfp_data, speed_data, channels_to_load, theta_phase, lfp_timestamps):
     '''
@@ -45,48 +170,22 @@ def get_data_for_traversals(arm_traversal_cycles, cycle_numbers, lfp_data, speed
     - Speed data interpolated up to match LFP sampling rate
     - Traversal Index (index of traversal in that arm, counting from 0 for each trial)
     
+    Built from get_traversal_data; use that directly to keep the data as arrays.
     '''
-    #Initialise variables
-    channels_to_load = [str(i) for i in channels_to_load] # Convert channel array into string to preserve ordering by depth
-    traversal_df = pd.DataFrame(index = channels_to_load)
-    traversal_index = 0
-
-    
-    # For each theta cycle for the given arm group, get LFP trace, theta phases and timestamp
-    for traversal in arm_traversal_cycles:
-        
-        mask = np.isin(cycle_numbers, traversal).flatten()
-        
-        cycle_data = lfp_data[mask, :].T
-        cycle_phases = theta_phase[mask, :]
-        cycle_timestamps = lfp_timestamps[mask]
-        cycle_id = cycle_numbers[mask]
-        cycle_speed = speed_data[mask]
-        
-        # Add traversal data to dataframe:
-        traversal_df.loc[channels_to_load, cycle_timestamps] = cycle_data #Add LFP data for each included channel
-        traversal_df.loc['Cycle Theta Phase', cycle_timestamps] = cycle_phases.flatten() # Add theta phase for each sample
-        traversal_df.loc['Cycle Index', cycle_timestamps] = cycle_id.flatten() # Add theta cycle index
-        traversal_df.loc['Traversal Index', cycle_timestamps] = np.ones(len(cycle_timestamps)) * traversal_index # Add traversal index
-        traversal_df.loc['Speed', cycle_timestamps] = cycle_speed
-        
-        traversal_index += 1
-        
-        # # Make a dict with structure: cycle_number: dataframe of data
-        # cycle_dict[tuple(traversal)] = cycle_frame
-        
-    return traversal_df
+    return get_traversal_data(arm_traversal_cycles, cycle_numbers, lfp_data, speed_data, channels_to_load, theta_phase, lfp_timestamps).to_dataframe()
 
 def drop_extreme_cycles(df):
     """
     Drops columns with the lowest and highest 'Cycle Index' value for each unique 'Traversal Index'.
 
     Args:
-        df (pd.DataFrame): DataFrame with 'Cycle Index' and 'Traversal Index' as rows.
+        df (pd.DataFrame or TraversalData): DataFrame with 'Cycle Index' and 'Traversal Index' as rows, or a TraversalData store.
 
     Returns:
-        pd.DataFrame: A new DataFrame with specified columns dropped.
+        pd.DataFrame or TraversalData: A new DataFrame with specified columns dropped, or a new TraversalData with the samples dropped.
     """
+    if isinstance(df, TraversalData):
+        return _drop_extreme_cycles_traversal_data(df)
 
     # Find the rows for 'Cycle Index' and 'Traversal Index'
     cycle_index_row = df.index[df.index == 'Cycle Index'][0]
@@ -113,3 +212,25 @@ def drop_extreme_cycles(df):
 
     # Transpose back to the original format
     return df_dropped.T
+
+def _drop_extreme_cycles_traversal_data(traversal_data):
+    """
+    drop_extreme_cycles for a TraversalData store, with the min and max cycle of every traversal found by a segmented reduction.
+    """
+    if len(traversal_data) == 0:
+        return traversal_data
+
+    # Segmented min and max over the non-empty traversals
+    traversal_lengths = np.diff(traversal_data.traversal_offsets)
+    non_empty = traversal_lengths > 0
+    segment_starts = traversal_data.traversal_offsets[:-1][non_empty]
+    cycle_min = np.full(traversal_data.n_traversals, np.nan)
+    cycle_max = np.full(traversal_data.n_traversals, np.nan)
+    cycle_min[non_empty] = np.minimum.reduceat(traversal_data.cycle_index, segment_starts)
+    cycle_max[non_empty] = np.maximum.reduceat(traversal_data.cycle_index, segment_starts)
+
+    cycle_index = traversal_data.cycle_index
+    traversal_index = traversal_data.traversal_index
+    keep = (cycle_index != cycle_min[traversal_index]) & (cycle_index != cycle_max[traversal_index])
+
+    return traversal_data.select(keep)
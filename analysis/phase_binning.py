@@ -0,0 +1,69 @@
+import numpy as np
+
+def bin_by_phase(data, phase, n_bins=100, weights=None, power=False):
+    """
+    Calculate the mean, count and standard error of the mean of a set of features in theta phase bins,
+    using np.bincount over (bin, feature) pairs in a single pass.
+
+    Parameters:
+    - data: Array of shape (samples, features) or (samples,), e.g. CSD (samples x channels) or wavelet coefficients
+        (samples x frequencies). Complex data is averaged as complex numbers unless power is True. NaN entries are ignored.
+    - phase: Theta phase (in radians, 0 - 2pi) of each sample. Samples with NaN phase or outside 0 - 2pi are ignored.
+    - n_bins: Number of equal-width phase bins between 0 and 2pi. Default is 100.
+    - weights: Optional weight for each sample. Default is None (equal weights).
+    - power: If True, bin the power (squared magnitude) of the data instead of the data. Default is False.
+
+    Returns:
+    - bin_centers: Centre of each phase bin (radians).
+    - means: Weighted mean of each feature in each bin, shape (n_bins, features). NaN for empty bins.
+    - counts: Number of samples of each feature in each bin, shape (n_bins, features).
+    - sem: Standard error of the mean, from the weighted variance with the unbiased (reliability weights)
+        correction, shape (n_bins, features). NaN for bins with fewer than 2 samples. For complex data, the real and
+        imaginary parts are combined (the SEM of the complex mean).
+    """
+    data = np.asarray(data)
+    is_1d = data.ndim == 1
+    if is_1d:
+        data = data[:, None]
+    if power:
+        data = np.abs(data) ** 2
+    n_samples, n_features = data.shape
+
+    bin_edges = np.linspace(0, 2 * np.pi, n_bins + 1)
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    phase_bins = np.digitize(phase, bin_edges) - 1
+
+    sample_weights = np.ones(n_samples) if weights is None else np.asarray(weights, dtype=float)
+
+    # Valid (sample, feature) entries, indexed into a flat (bins, features) array
+    valid = (phase_bins >= 0) & (phase_bins < n_bins) & ~np.isnan(sample_weights)
+    valid = valid[:, None] & ~np.isnan(data)
+    sample_indices, feature_indices = np.nonzero(valid)
+    flat_bins = phase_bins[sample_indices] * n_features + feature_indices
+    values = data[sample_indices, feature_indices]
+    entry_weights = sample_weights[sample_indices]
+
+    def binned_sum(entry_values):
+        return np.bincount(flat_bins, entry_values, minlength=n_bins * n_features).reshape(n_bins, n_features)
+
+    counts = np.bincount(flat_bins, minlength=n_bins * n_features).reshape(n_bins, n_features)
+    weight_sum = binned_sum(entry_weights)
+    weight_sq_sum = binned_sum(entry_weights ** 2)
+
+    # np.bincount weights must be real, so complex data is summed as real and imaginary parts
+    if np.iscomplexobj(values):
+        value_sum = binned_sum(entry_weights * values.real) + 1j * binned_sum(entry_weights * values.imag)
+    else:
+        value_sum = binned_sum(entry_weights * values)
+    value_sq_sum = binned_sum(entry_weights * np.abs(values) ** 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = value_sum / weight_sum
+        squared_deviation_sum = np.maximum(value_sq_sum - weight_sum * np.abs(means) ** 2, 0)
+        variance = squared_deviation_sum / (weight_sum - weight_sq_sum / weight_sum)
+        sem = np.sqrt(variance * weight_sq_sum) / weight_sum
+    sem[counts < 2] = np.nan
+
+    if is_1d:
+        return bin_centers, means[:, 0], counts[:, 0], sem[:, 0]
+    return bin_centers, means, counts, sem
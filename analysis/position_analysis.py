@@ -1,13 +1,17 @@
 import numpy as np
 import pandas as pd
 
-def assign_sectors(xy_positions, pos_header):
+def assign_sectors(xy_positions, pos_header, num_cols=4, num_rows=3):
     """
     Assign sectors to given xy_positions based on a grid layout.
+    Sectors are numbered from 1, along each row of the grid (x) and then across rows (y).
+    All positions are assigned at once with floor-divide arithmetic.
     
     Parameters:
     - xy_positions (DataFrame): DataFrame containing x and y coordinates.
     - pos_header (dict): position header dictionary from ephys object
+    - num_cols (int): Number of grid columns (along x). Default is 4.
+    - num_rows (int): Number of grid rows (along y). Default is 3.
     
     Returns:
     - sector_numbers (ndarray): Array containing sector numbers for each coordinate.
@@ -22,56 +26,100 @@ def assign_sectors(xy_positions, pos_header):
         if xy_positions.shape[1] != 2:
             raise ValueError('Invalid input dimensions.')
             
-    # Drop rows where either x or y is NaN only for min/max calculation
-    xy_positions_filtered = xy_positions.dropna(subset=[xy_positions.columns[0], xy_positions.columns[1]])
+    xy = xy_positions.to_numpy(dtype=float)
+    is_nan = np.isnan(xy).any(axis=1)
     
     # Check if DataFrame is empty after removing NaNs
-    if xy_positions_filtered.empty:
+    if is_nan.all():
         raise ValueError("Input DataFrame is empty after removing NaN values.")
     
-    # Calculate the minimum and maximum x, y coordinates to determine the field of view (FOV)
-    # These coordinates are rounded to the nearest lower and upper bin edges, respectively
+    # Field of view (FOV) from the position header
     min_x = pos_header['min_x']
     max_x = pos_header['max_x']
     min_y = pos_header['min_y']
     max_y = pos_header['max_y']
     
-    # Define grid dimensions
-    num_cols = 4
-    num_rows = 3
-    
     # Calculate sector dimensions
     sector_width = (max_x - min_x) / num_cols
     sector_height = (max_y - min_y) / num_rows
     
-    # Initialize sector numbers array
-    num_positions = xy_positions.shape[0]
-    sector_numbers = np.zeros(num_positions)
-    
-    for i in range(num_positions):
-        # Extract x and y coordinates
-        x_pos = xy_positions.iloc[i, 0]
-        y_pos = xy_positions.iloc[i, 1]
-        
-        # Assign NaN if either coordinate is NaN
-        if np.isnan(x_pos) or np.isnan(y_pos):
-            sector_numbers[i] = np.nan
-            continue
-
-        # Calculate column and row indices
-        col_index = int(np.floor((x_pos - min_x) / sector_width)) + 1
-        row_index = int(np.floor((y_pos - min_y) / sector_height)) + 1
-        
-        # Clamp indices within valid range
-        col_index = max(1, min(col_index, num_cols))
-        row_index = max(1, min(row_index, num_rows))
-        
-        # Calculate and store sector number
-        sector_number = (row_index - 1) * num_cols + col_index
-        sector_numbers[i] = sector_number
+    # Calculate column and row indices, clamped within valid range
+    with np.errstate(invalid='ignore'):
+        col_index = np.clip(np.floor((xy[:, 0] - min_x) / sector_width), 0, num_cols - 1)
+        row_index = np.clip(np.floor((xy[:, 1] - min_y) / sector_height), 0, num_rows - 1)
+    
+    # Calculate sector numbers, with NaN if either coordinate is NaN
+    sector_numbers = row_index * num_cols + col_index + 1
+    sector_numbers[is_nan] = np.nan
     
     return sector_numbers
 
+def make_zone_raster(zones, pos_header, bin_size=1):
+    """
+    Precompute a label raster for a set of polygon zones (e.g. T-maze arms and reward sites) over the field of view,
+    so that positions can be assigned to zones with a single array lookup (assign_zones).
+    
+    Parameters:
+    - zones (dict): Zone names mapped to polygon vertices, each an (n_vertices, 2) array of x, y coordinates
+      in the same units as the position data. Where zones overlap, later zones take precedence.
+    - pos_header (dict): position header dictionary from ephys object
+    - bin_size (float): Raster bin size, in position units. Default is 1.
+    
+    Returns:
+    - zone_raster (ndarray): Array of shape (y bins, x bins) with the zone number (1 to number of zones) of each bin, 0 outside all zones.
+    - zone_names (list): Zone names, in zone number order (zone_names[0] is zone 1).
+    """
+    from matplotlib.path import Path
+    
+    min_x, max_x = pos_header['min_x'], pos_header['max_x']
+    min_y, max_y = pos_header['min_y'], pos_header['max_y']
+    
+    n_x = int(np.ceil((max_x - min_x) / bin_size))
+    n_y = int(np.ceil((max_y - min_y) / bin_size))
+    
+    # Bin centres
+    x_centres = min_x + (np.arange(n_x) + 0.5) * bin_size
+    y_centres = min_y + (np.arange(n_y) + 0.5) * bin_size
+    grid_x, grid_y = np.meshgrid(x_centres, y_centres)
+    bin_centres = np.column_stack([grid_x.ravel(), grid_y.ravel()])
+    
+    zone_raster = np.zeros(n_y * n_x, dtype=int)
+    zone_names = list(zones.keys())
+    for zone_number, zone_name in enumerate(zone_names, start=1):
+        inside = Path(np.asarray(zones[zone_name], dtype=float)).contains_points(bin_centres)
+        zone_raster[inside] = zone_number
+    
+    return zone_raster.reshape(n_y, n_x), zone_names
+
+def assign_zones(xy_positions, zone_raster, pos_header, bin_size=1):
+    """
+    Assign zones to given xy_positions by lookup in a zone raster from make_zone_raster.
+    
+    Parameters:
+    - xy_positions (DataFrame or ndarray): x and y coordinates, shape (positions, 2).
+    - zone_raster (ndarray): Zone raster from make_zone_raster.
+    - pos_header (dict): position header dictionary from ephys object, as used for the raster
+    - bin_size (float): Raster bin size, as used for the raster. Default is 1.
+    
+    Returns:
+    - zone_numbers (ndarray): Zone number for each coordinate, 0 outside all zones (or outside the raster), NaN if either coordinate is NaN.
+    """
+    xy = np.asarray(xy_positions, dtype=float)
+    if xy.shape[1] != 2:
+        xy = xy.T
+    
+    is_nan = np.isnan(xy).any(axis=1)
+    with np.errstate(invalid='ignore'):
+        x_bin = np.floor((xy[:, 0] - pos_header['min_x']) / bin_size)
+        y_bin = np.floor((xy[:, 1] - pos_header['min_y']) / bin_size)
+    in_raster = ~is_nan & (x_bin >= 0) & (x_bin < zone_raster.shape[1]) & (y_bin >= 0) & (y_bin < zone_raster.shape[0])
+    
+    zone_numbers = np.zeros(len(xy))
+    zone_numbers[in_raster] = zone_raster[y_bin[in_raster].astype(int), x_bin[in_raster].astype(int)]
+    zone_numbers[is_nan] = np.nan
+    
+    return zone_numbers
+
 def calculate_choices(xy_positions, sector_numbers):
     """
     Function to calculate choice statistics based on sector numbers for each XY position.
@@ -99,103 +147,131 @@ def calculate_choices(xy_positions, sector_numbers):
     If the animal starts in the left sectors (sector numbers 1, 2, 3, 4) or the right sectors (sector numbers 9, 10, 11, 12), 
     a message will be printed to the console. If the sector numbers are not within these ranges, an error message will be printed.
 
-    The function uses a state variable `choice` to keep track of the current choice (left, right, or center), 
-    and this is updated based on the current sector number. The choice is then encoded as a numeric value (left: 1, right: 2, center: 0) 
-    and stored in the `arm_ind` array.
-
-    After encoding the choices, the function removes consecutive duplicates to get the sequence of arm visits `arm_visit_order`. 
-    It then iterates over this sequence to count the number of choices made and the number of correct choices. 
+    The current choice (left, right, or center) is updated based on the current sector number and forward-filled, 
+    encoded as a numeric value (left: 1, right: 2, center: 0). Consecutive duplicates are then removed (run-length encoding) 
+    to get the sequence of arm visits, and choices are counted over this sequence in one pass (see score_choices). 
     A correct choice is defined as a choice to go in the opposite direction of the previous choice.
 
     Finally, it calculates the proportion of correct choices and the proportion of left choices and returns these values in a dictionary.
     """
-    arm_ind = np.zeros(len(sector_numbers))
-    
-    choice = ''
-    # # Initialize choice as starting arm (usually centre)
-    # if sector_numbers[0] in [5,6,7,8]:
-    #     choice = 'centre'
-    # elif sector_numbers[0] in [1,2,3,4]:
-    #     choice = 'left'
-    #     print('Animal not starting trial in centre arm')
-    # elif sector_numbers[0] in [9, 10, 11, 12]:
-    #     choice = 'right'
-    #     print('Animal not starting trial in centre arm')
-    # else:
-    #     choice = ''
-    #     print('Sectors assigned incorrectly, please check')
-        
-    for i in range(len(sector_numbers)):
-        if sector_numbers[i] == 8:
-            choice = 'centre'
-        elif sector_numbers[i] == 1:
-            choice = 'left'
-        elif sector_numbers[i] == 9:
-            choice = 'right'
-            
-        if choice == 'centre':
-            arm_ind[i] = 0
-        elif choice == 'left':
-            arm_ind[i] = 1
-        elif choice == 'right':
-            arm_ind[i] = 2
-        else:
-            arm_ind[i] = -1
-            
-    # Calculate total choice counts & proportion correct
-    # Create sequence of arm visits
-    arm_visit_order = arm_ind[np.concatenate([[True], np.diff(arm_ind) != 0])]
-    
-    # Initialize counters
-    total_choices = 0
-    total_left_choices = 0
-    total_right_choices = 0
-    total_correct_choices = 0
-    
-    # Iterate over the arm_visit_order array
-    previous_choice = -1  # Initialize previous choice to an invalid value
-    for i in range(len(arm_visit_order)):
-        current_choice = arm_visit_order[i]
-        
-        if current_choice == 0:
-            # Central arm visit
-            if previous_choice != -1:
-                # Check if the previous choice was valid
-                next_value_indices = np.where(arm_visit_order[i+1:] != 0)[0]
-                if len(next_value_indices) > 0:
-                    next_value = arm_visit_order[i+1+next_value_indices[0]]
-
-                    if next_value == 1:
-                        total_left_choices += 1
-                    elif next_value == 2:
-                        total_right_choices += 1
-
-                    # Increment the total number of choices
-                    total_choices += 1
-
-                    if (previous_choice == 1 and next_value == 2) or (previous_choice == 2 and next_value == 1):
-                        # Correct choice (opposite arm to the previous choice)
-                        total_correct_choices += 1
-        # Update the previous choice
-        previous_choice = current_choice
-    
-    try:
-        # Calculate the proportion of correct choices
-        p_correct = total_correct_choices / total_choices
+    choice_counts = score_choices(sector_numbers).iloc[0]
+    
+    return {
+        "total_choices": int(choice_counts["total_choices"]),
+        "total_left_choices": int(choice_counts["total_left_choices"]),
+        "total_right_choices": int(choice_counts["total_right_choices"]),
+        "total_correct_choices": int(choice_counts["total_correct_choices"]),
+        "p_correct": float(choice_counts["p_correct"]),
+        "p_left_choices": float(choice_counts["p_left_choices"])
+    }
 
-        # Calculate the proportion of left choices
-        p_left_choices = total_left_choices / total_choices
+def score_choices(sector_numbers, trial_ids=None, n_trials=None):
+    """
+    Vectorised choice scoring (as calculate_choices) for one or many trials at once.
     
-    # Catch case where n_choices = 0
-    except ZeroDivisionError:
-        p_correct = np.nan
-        p_left_choices = np.nan
+    Arm state (centre: 0, left: 1, right: 2, none yet: -1) is set by sectors 8, 1 and 9 and forward-filled
+    within each trial. Arm visits are the runs of the run-length encoded arm state. Every centre visit that
+    follows an arm visit and is followed by an arm visit in the same trial is scored as one choice.
     
-    return {
+    Parameters:
+    sector_numbers (numpy.ndarray): Sector numbers for each XY position, concatenated across trials.
+    trial_ids (numpy.ndarray, optional): Integer trial label (0 to number of trials - 1) for each position,
+                                         with the positions of each trial contiguous. Default is None (one trial).
+    n_trials (int, optional): Number of trials, so that trials without positions get a row. Default is None
+                              (the highest trial label + 1).
+    
+    Returns:
+    pd.DataFrame: One row per trial, with the columns of the calculate_choices output.
+    """
+    sector_numbers = np.asarray(sector_numbers, dtype=float)
+    if trial_ids is None:
+        trial_ids = np.zeros(len(sector_numbers), dtype=int)
+    trial_ids = np.asarray(trial_ids, dtype=int)
+    if n_trials is None:
+        n_trials = int(trial_ids.max()) + 1 if len(trial_ids) else 1
+    
+    # Arm state set by the choice sectors
+    arm_state = np.full(len(sector_numbers), -1)
+    arm_state[sector_numbers == 8] = 0
+    arm_state[sector_numbers == 1] = 1
+    arm_state[sector_numbers == 9] = 2
+    
+    # Forward fill arm state within each trial, from the last sample that set it
+    is_set = arm_state != -1
+    last_set = np.maximum.accumulate(np.where(is_set, np.arange(len(arm_state)), -1))
+    trial_start = np.diff(trial_ids, prepend=-1) != 0
+    trial_first_sample = np.maximum.accumulate(np.where(trial_start, np.arange(len(arm_state)), 0))
+    arm_ind = np.where(last_set >= trial_first_sample, arm_state[np.maximum(last_set, 0)], -1)
+    
+    # Run-length encode arm state into arm visits, starting a new run at each trial
+    run_starts = trial_start | (np.diff(arm_ind, prepend=arm_ind[:1]) != 0)
+    arm_visit_order = arm_ind[run_starts]
+    visit_trials = trial_ids[run_starts]
+    
+    # Centre visits with a previous and next arm visit in the same trial
+    previous_visit = arm_visit_order[:-2]
+    centre_visit = arm_visit_order[1:-1]
+    next_visit = arm_visit_order[2:]
+    same_trial = (visit_trials[:-2] == visit_trials[1:-1]) & (visit_trials[1:-1] == visit_trials[2:])
+    is_choice = same_trial & (centre_visit == 0) & (previous_visit != -1)
+    
+    choice_trials = visit_trials[1:-1][is_choice]
+    choice_previous, choice_next = previous_visit[is_choice], next_visit[is_choice]
+    is_correct = ((choice_previous == 1) & (choice_next == 2)) | ((choice_previous == 2) & (choice_next == 1))
+    
+    total_choices = np.bincount(choice_trials, minlength=n_trials)
+    total_left_choices = np.bincount(choice_trials[choice_next == 1], minlength=n_trials)
+    total_right_choices = np.bincount(choice_trials[choice_next == 2], minlength=n_trials)
+    total_correct_choices = np.bincount(choice_trials[is_correct], minlength=n_trials)
+    
+    # Proportions are NaN where n_choices = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_correct = np.where(total_choices > 0, total_correct_choices / total_choices, np.nan)
+        p_left_choices = np.where(total_choices > 0, total_left_choices / total_choices, np.nan)
+    
+    return pd.DataFrame({
         "total_choices": total_choices,
         "total_left_choices": total_left_choices,
         "total_right_choices": total_right_choices,
         "total_correct_choices": total_correct_choices,
         "p_correct": p_correct,
         "p_left_choices": p_left_choices
-    }
+    })
+
+def calculate_choices_batch(sessions, trial_name_filter='t-maze'):
+    """
+    Score alternation performance for every T-maze trial in one or more sessions, in a single vectorised pass.
+    Position data is loaded for any matching trial that does not have it yet. Positions are assigned to the default
+    4 x 3 sector grid, on which score_choices' centre, left and right sectors (8, 1 and 9) are defined.
+    
+    Parameters:
+    sessions (ephys or list of ephys): Session object(s).
+    trial_name_filter (str): Trials whose name contains this string are scored. Default is 't-maze'.
+    
+    Returns:
+    pd.DataFrame: One row per trial with 'animal', 'date', 'trial_iterator' and 'trial_name', followed by the
+                  columns of the calculate_choices output.
+    """
+    if not isinstance(sessions, (list, tuple)):
+        sessions = [sessions]
+    
+    trial_info = []
+    sector_list = []
+    for obj in sessions:
+        for trial_iterator, trial_name in enumerate(obj.trial_list):
+            if trial_name_filter not in trial_name:
+                continue
+            if obj.pos_data[trial_iterator] is None:
+                obj.load_pos(trial_iterator, output_flag=False)
+            
+            pos_data = obj.pos_data[trial_iterator]
+            sector_list.append(assign_sectors(pos_data['xy_position'], pos_data['header']))
+            trial_info.append({'animal': obj.animal, 'date': obj.date, 'trial_iterator': trial_iterator, 'trial_name': trial_name})
+    
+    if not trial_info:
+        return pd.DataFrame(columns=['animal', 'date', 'trial_iterator', 'trial_name'] + list(score_choices([]).columns))
+    
+    trial_ids = np.repeat(np.arange(len(sector_list)), [len(sectors) for sectors in sector_list])
+    choices = score_choices(np.concatenate(sector_list), trial_ids, n_trials=len(sector_list))
+    
+    return pd.concat([pd.DataFrame(trial_info), choices], axis=1)
@@ -16,4 +16,102 @@ def rayleigh_vector(phases):
     R = np.sqrt(sum_sin**2 + sum_cos**2) / n
     mean_angle = np.arctan2(sum_sin, sum_cos)
 
-    return R, mean_angle
\ No newline at end of file
+    return R, mean_angle
+
+def rayleigh_vector_grouped(phases, groups, n_groups=None):
+    """
+    Calculate the normalized Rayleigh vector magnitude and direction, and the Rayleigh test of uniformity, for every
+    group of phase angles at once, using np.bincount on the sines and cosines. NaN phases are ignored and not counted.
+    Rayleigh p values use the approximation from Zar (1999), Biostatistical Analysis, eq. 27.4.
+
+    :param phases: NumPy array of phase angles in radians.
+    :param groups: Integer array of group labels (0 to n_groups - 1), one per phase, e.g. cluster, trial or phase bin indices.
+    :param n_groups: Number of groups. Default is groups.max() + 1.
+    :return: A tuple of arrays (R, mean_angle, z, p, n), one value per group. Groups with no valid phases are NaN.
+    """
+    phases = np.asarray(phases, dtype=float)
+    groups = np.asarray(groups)
+    if n_groups is None:
+        n_groups = int(groups.max()) + 1 if groups.size else 0
+
+    valid = ~np.isnan(phases)
+    phases, groups = phases[valid], groups[valid]
+
+    n = np.bincount(groups, minlength=n_groups)
+    sum_sin = np.bincount(groups, np.sin(phases), minlength=n_groups)
+    sum_cos = np.bincount(groups, np.cos(phases), minlength=n_groups)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R = np.sqrt(sum_sin**2 + sum_cos**2) / n
+        mean_angle = np.where(n > 0, np.arctan2(sum_sin, sum_cos), np.nan)
+
+        # Rayleigh test
+        z = n * R**2
+        p = np.exp(np.sqrt(1 + 4 * n + 4 * (n**2 - (R * n)**2)) - (1 + 2 * n))
+    p = np.clip(p, 0, 1)
+
+    return R, mean_angle, z, p, n
+
+
+def rayleigh_shuffle_test_grouped(phases, groups, n_groups=None, n_shuffles=1000, reference_phases=None, chunk_size=100, seed=None):
+    """
+    Shuffle test for phase locking of every group of phase angles at once. For each shuffle, every phase is replaced
+    by a phase drawn at random, either uniformly or from a reference distribution (e.g. the theta phase of all LFP
+    samples, to account for a non-uniform LFP phase distribution), and the Rayleigh vector of each group is recomputed.
+    Shuffles are processed in chunks, with all groups and shuffles in a chunk reduced by a single np.bincount.
+
+    :param phases: NumPy array of phase angles in radians. NaN phases are ignored.
+    :param groups: Integer array of group labels (0 to n_groups - 1), one per phase.
+    :param n_groups: Number of groups. Default is groups.max() + 1.
+    :param n_shuffles: Number of shuffles. Default is 1000.
+    :param reference_phases: Phases to draw shuffled phases from. Default is None (uniform on 0 - 2pi).
+    :param chunk_size: Number of shuffles processed at once. Default is 100.
+    :param seed: Seed for the random number generator. Default is None.
+    :return: A tuple of arrays (R, p_value, R_zscore), one value per group. p_value is the fraction of shuffles
+        with R at least as large as the real R, with the real R counted as one shuffle. R_zscore is the real R
+        relative to the mean and standard deviation of the shuffled R.
+    """
+    phases = np.asarray(phases, dtype=float)
+    groups = np.asarray(groups)
+    if n_groups is None:
+        n_groups = int(groups.max()) + 1 if groups.size else 0
+
+    valid = ~np.isnan(phases)
+    phases, groups = phases[valid], groups[valid]
+    if reference_phases is not None:
+        reference_phases = np.asarray(reference_phases, dtype=float)
+        reference_phases = reference_phases[~np.isnan(reference_phases)]
+
+    R, _, _, _, n = rayleigh_vector_grouped(phases, groups, n_groups)
+
+    rng = np.random.default_rng(seed)
+    n_exceed = np.zeros(n_groups)
+    shuffle_sum = np.zeros(n_groups)
+    shuffle_sum_sq = np.zeros(n_groups)
+
+    for chunk_start in range(0, n_shuffles, chunk_size):
+        n_chunk = min(chunk_size, n_shuffles - chunk_start)
+
+        if reference_phases is None:
+            shuffled_phases = rng.uniform(0, 2 * np.pi, (n_chunk, len(phases)))
+        else:
+            shuffled_phases = reference_phases[rng.integers(len(reference_phases), size=(n_chunk, len(phases)))]
+
+        # Flat (shuffle, group) labels, so all shuffles in the chunk share one bincount
+        flat_groups = (groups[None, :] + np.arange(n_chunk)[:, None] * n_groups).ravel()
+        sum_sin = np.bincount(flat_groups, np.sin(shuffled_phases).ravel(), minlength=n_chunk * n_groups)
+        sum_cos = np.bincount(flat_groups, np.cos(shuffled_phases).ravel(), minlength=n_chunk * n_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shuffled_R = np.sqrt(sum_sin**2 + sum_cos**2).reshape(n_chunk, n_groups) / n
+
+        n_exceed += np.sum(shuffled_R >= R, axis=0)
+        shuffle_sum += shuffled_R.sum(axis=0)
+        shuffle_sum_sq += (shuffled_R**2).sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_value = np.where(n > 0, (n_exceed + 1) / (n_shuffles + 1), np.nan)
+        shuffle_mean = shuffle_sum / n_shuffles
+        shuffle_std = np.sqrt(np.maximum(shuffle_sum_sq / n_shuffles - shuffle_mean**2, 0))
+        R_zscore = (R - shuffle_mean) / shuffle_std
+
+    return R, p_value, R_zscore
@@ -31,6 +31,96 @@ def interpolate_map(map, max_dim):
 
     return interpolated_map
 
+def resample_map_regular(map, max_dim):
+    """
+    Place a map on a regular grid of the given dimensions, without Delaunay triangulation.
+
+    Rate maps are already on regular grids, and interpolate_map evaluates them at the same integer bin
+    coordinates on the common grid, so resampling reduces to copying the map into a NaN-filled array
+    (cropping any part that does not fit). Unlike interpolate_map, NaN bins inside the map are left as
+    NaN rather than filled by linear interpolation, and are excluded from correlations instead.
+
+    Parameters:
+    map (ndarray): The input map to be resampled.
+    max_dim (tuple): The dimensions (rows, columns) of the resampled map.
+
+    Returns:
+    ndarray: The resampled map, with shape max_dim.
+    """
+    resampled_map = np.full(max_dim, np.nan)
+    n_rows = min(map.shape[0], max_dim[0])
+    n_cols = min(map.shape[1], max_dim[1])
+    resampled_map[:n_rows, :n_cols] = map[:n_rows, :n_cols]
+    return resampled_map
+
+def masked_corr_matrix(maps1, maps2=None):
+    """
+    NaN-aware Pearson correlation between every pair of flattened maps, using masked matrix products.
+    For each pair, only bins that are valid in both maps are used, as in pearson_corr.
+
+    Parameters:
+    maps1 (ndarray): 2D array of flattened maps, shape (n_maps1, n_bins).
+    maps2 (ndarray, optional): 2D array of flattened maps, shape (n_maps2, n_bins). Defaults to maps1.
+
+    Returns:
+    ndarray: Correlation matrix of shape (n_maps1, n_maps2). NaN where fewer than 2 bins overlap or a map is constant.
+    """
+    if maps2 is None:
+        maps2 = maps1
+
+    valid1 = ~np.isnan(maps1)
+    valid2 = ~np.isnan(maps2)
+
+    # Centre each map on its own mean to reduce cancellation (correlation is unaffected by a constant shift)
+    with np.errstate(invalid='ignore'):
+        x = np.where(valid1, maps1 - np.nanmean(np.where(valid1, maps1, np.nan), axis=1, keepdims=True), 0.0)
+        y = np.where(valid2, maps2 - np.nanmean(np.where(valid2, maps2, np.nan), axis=1, keepdims=True), 0.0)
+    m1 = valid1.astype(float)
+    m2 = valid2.astype(float)
+
+    # Sums over the bins valid in both maps of each pair
+    n = m1 @ m2.T
+    sum_x = x @ m2.T
+    sum_y = m1 @ y.T
+    sum_xx = (x ** 2) @ m2.T
+    sum_yy = m1 @ (y ** 2).T
+    sum_xy = x @ y.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = n * sum_xy - sum_x * sum_y
+        var_x = n * sum_xx - sum_x ** 2
+        var_y = n * sum_yy - sum_y ** 2
+        corr = cov / np.sqrt(var_x * var_y)
+    corr[(n < 2) | (var_x <= 0) | (var_y <= 0)] = np.nan
+
+    return np.clip(corr, -1, 1)
+
+def masked_paired_corr(maps1, maps2):
+    """
+    NaN-aware Pearson correlation between corresponding rows of two arrays of flattened maps.
+
+    Parameters:
+    maps1 (ndarray): 2D array of flattened maps, shape (n_maps, n_bins).
+    maps2 (ndarray): 2D array of flattened maps, shape (n_maps, n_bins).
+
+    Returns:
+    ndarray: Array of n_maps correlation coefficients. NaN where fewer than 2 bins overlap or a map is constant.
+    """
+    valid = ~np.isnan(maps1) & ~np.isnan(maps2)
+    n = valid.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(valid, maps1, 0.0)
+        y = np.where(valid, maps2, 0.0)
+        x = np.where(valid, x - (x.sum(axis=1) / n)[:, None], 0.0)
+        y = np.where(valid, y - (y.sum(axis=1) / n)[:, None], 0.0)
+        var_x = np.sum(x ** 2, axis=1)
+        var_y = np.sum(y ** 2, axis=1)
+        corr = np.sum(x * y, axis=1) / np.sqrt(var_x * var_y)
+    corr[(n < 2) | (var_x <= 0) | (var_y <= 0)] = np.nan
+
+    return np.clip(corr, -1, 1)
+
 def pearson_corr(map1, map2):
     """ Calculate Pearson correlation for two flattened maps. """
     valid_mask = ~np.isnan(map1) & ~np.isnan(map2)
@@ -39,7 +129,7 @@ def pearson_corr(map1, map2):
     else:
         return np.nan
 
-def spatial_correlation(map_list1, map_list2=None):
+def spatial_correlation(map_list1, map_list2=None, method='griddata'):
     """
     Calculate the spatial correlation between 2D rate maps, interpolating them to a common size.
     The common size is determined as the maximum size among all maps.
@@ -47,6 +137,10 @@ def spatial_correlation(map_list1, map_list2=None):
     Parameters:
     - map_list1: A list of 2D numpy arrays representing rate maps.
     - map_list2: (Optional) Another list of 2D numpy arrays representing rate maps.
+    - method: (Optional) 'griddata' interpolates each map with interpolate_map and correlates pairs with pearsonr.
+              'regular' places maps on the common grid with resample_map_regular and computes all correlations
+              at once with NaN-aware matrix products, which scales to thousands of maps. NaN bins inside a map
+              are excluded rather than interpolated. Defaults to 'griddata'.
 
     Returns:
     - A matrix of Pearson correlation coefficients if only map_list1 is provided.
@@ -57,6 +151,17 @@ def spatial_correlation(map_list1, map_list2=None):
     all_maps = map_list1 + (map_list2 if map_list2 else [])
     max_dim = max([(m.shape[0], m.shape[1]) for m in all_maps], key=lambda x: x[0]*x[1])
 
+    if method == 'regular':
+        # Stack flattened maps on the common grid and correlate them all at once
+        stacked_maps1 = np.array([resample_map_regular(m, max_dim).ravel() for m in map_list1])
+        if not map_list2:
+            return masked_corr_matrix(stacked_maps1)
+        stacked_maps2 = np.array([resample_map_regular(m, max_dim).ravel() for m in map_list2])
+        n_maps = min(len(stacked_maps1), len(stacked_maps2))
+        return masked_paired_corr(stacked_maps1[:n_maps], stacked_maps2[:n_maps])
+    elif method != 'griddata':
+        raise ValueError("method must be 'griddata' or 'regular'")
+
     # Interpolate maps to the maximum dimensions
     interpolated_maps1 = [interpolate_map(m, max_dim) for m in map_list1]
     interpolated_maps2 = [interpolate_map(m, max_dim) for m in map_list2] if map_list2 else None
@@ -1,14 +1,25 @@
+import os
+from pathlib import Path
 import numpy as np
+import pandas as pd
 import pynapple as nap
 from .spatial_information import spatial_info
-from spelt.maps.rate_maps import make_rate_maps
-from joblib import Parallel, delayed
+from spelt.maps.rate_maps import make_rate_maps, make_occupancy_grid, bin_spikes_to_pos_samples
+from spelt.maps.adaptive_smooth import adaptive_smooth_multi
+from joblib import Parallel, delayed, effective_n_jobs
 
-def compute_shuffle(spike_times_real, pos_sample_times, pos_bin_idx, pos_sampling_rate):
+def compute_shuffle(spike_times_real, pos_sample_times, pos_bin_idx, pos_sampling_rate, seed = None):
     
-    # Shuffle spike times
-    spike_times_shuffled = nap.shuffle_ts_intervals(spike_times_real)
-    spike_times_shuffled = np.array(spike_times_shuffled.as_series().index)
+    # Shuffle spike times. With a seed, the intervals are permuted as in nap.shuffle_ts_intervals,
+    # but from this task's own random stream rather than the global numpy RNG
+    if seed is None:
+        spike_times_shuffled = nap.shuffle_ts_intervals(spike_times_real)
+        spike_times_shuffled = np.array(spike_times_shuffled.as_series().index)
+    else:
+        rng = np.random.default_rng(seed)
+        spike_times = spike_times_real.times()
+        shuffled_intervals = rng.permutation(np.diff(spike_times))
+        spike_times_shuffled = np.hstack([spike_times[0], spike_times[0] + np.cumsum(shuffled_intervals)])
 
     # Calculate rate map
     rate_map_shuffled, pos_map = make_rate_maps(spike_times_shuffled, pos_sample_times, pos_bin_idx, pos_sampling_rate, max_rates = False)
@@ -18,7 +29,7 @@ def compute_shuffle(spike_times_real, pos_sample_times, pos_bin_idx, pos_samplin
 
     return bits_per_spike_shuffled, bits_per_sec_shuffled
 
-def spatial_significance(pos_sample_times, pos_bin_idx, pos_sampling_rate, spike_times_real, n_shuffles = 1000):
+def spatial_significance(pos_sample_times, pos_bin_idx, pos_sampling_rate, spike_times_real, n_shuffles = 1000, seed = None):
     """
     Calculate the significance of spatial information for a given cluster by shuffling spike times and recalculating spatial information.
     
@@ -32,6 +43,9 @@ def spatial_significance(pos_sample_times, pos_bin_idx, pos_sampling_rate, spike
         Array of spike times for a given cluster
     n_shuffles : int
         Number of shuffles to perform
+    seed : int or numpy.random.SeedSequence, optional
+        Seed for the shuffles. Each shuffle gets an independent child stream spawned from it, so results do not
+        depend on how shuffles are scheduled across workers. Defaults to None (pynapple's global RNG)
     
     Returns
     -------
@@ -50,8 +64,11 @@ def spatial_significance(pos_sample_times, pos_bin_idx, pos_sampling_rate, spike
 
     spike_times_real = nap.Ts(t=spike_times_real, time_units="s") #Pynapple object
 
+    # Spawn an independent random stream for each shuffle
+    shuffle_seeds = make_seed_sequence(seed).spawn(n_shuffles) if seed is not None else [None] * n_shuffles
+
     # Perform shuffles in parallel        
-    results = Parallel(n_jobs=-1)(delayed(compute_shuffle)(spike_times_real, pos_sample_times, pos_bin_idx, pos_sampling_rate) for _ in range(n_shuffles))
+    results = Parallel(n_jobs=-1)(delayed(compute_shuffle)(spike_times_real, pos_sample_times, pos_bin_idx, pos_sampling_rate, shuffle_seed) for shuffle_seed in shuffle_seeds)
 
     # Unpack results
     bits_per_spike_shuffled, bits_per_sec_shuffled = zip(*results)
@@ -69,4 +86,473 @@ def spatial_significance(pos_sample_times, pos_bin_idx, pos_sampling_rate, spike
     # Note: This calculation assumes a one-tailed test, as we're only interested if the real value is significantly higher
     p_value = np.sum(bits_per_spike_shuffled >= bits_per_spike_real) / n_shuffles
 
-    return p_value, bits_per_spike_z, bits_per_spike_shuffled
\ No newline at end of file
+    return p_value, bits_per_spike_z, bits_per_spike_shuffled
+
+def make_seed_sequence(seed = None):
+    """
+    Make a numpy SeedSequence from a seed, so that independent child streams can be spawned for shuffles.
+
+    Parameters
+    ----------
+    seed : int, numpy.random.SeedSequence or None
+        Seed to use. None draws fresh entropy from the OS
+
+    Returns
+    -------
+    seed_sequence : numpy.random.SeedSequence
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+def draw_shift_offsets(n_samples, pos_sampling_rate, n_shuffles, min_shift = 20, rng = None):
+    """
+    Draw random circular shift offsets, in position samples, for shift shuffles.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of position samples
+    pos_sampling_rate : float
+        Sampling rate of the position data in Hz
+    n_shuffles : int
+        Number of offsets to draw
+    min_shift : float
+        Minimum shift in seconds. Offsets are drawn uniformly between min_shift and (trial length - min_shift)
+    rng : numpy.random.Generator, optional
+        Random number generator to draw offsets from. Defaults to a new unseeded generator
+
+    Returns
+    -------
+    offsets : array
+        Integer array of n_shuffles offsets
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    min_shift_samples = max(min(int(round(min_shift * pos_sampling_rate)), (n_samples - 1) // 2), 1)
+    return rng.integers(min_shift_samples, n_samples - min_shift_samples, size=n_shuffles, endpoint=True)
+
+def shuffle_spike_pos_idx(spike_times, pos_sample_times, pos_sampling_rate, n_shuffles, shuffle_method = 'isi', min_shift = 20, rng = None):
+    """
+    Generate the position sample index of every spike for a set of shuffles, as a single matrix.
+
+    Parameters
+    ----------
+    spike_times : array
+        Array of spike times for a given cluster, in seconds
+    pos_sample_times : array
+        Array of time points at which position data was sampled
+    pos_sampling_rate : float
+        Sampling rate of the position data in Hz
+    n_shuffles : int
+        Number of shuffles to generate
+    shuffle_method : str
+        'isi' permutes the inter-spike intervals of each shuffle, as nap.shuffle_ts_intervals does.
+        'shift' circularly shifts the spike train relative to the position samples by a random offset.
+    min_shift : float
+        Minimum circular shift in seconds, used when shuffle_method is 'shift'
+    rng : numpy.random.Generator, optional
+        Random number generator to draw shuffles from. Defaults to a new unseeded generator
+
+    Returns
+    -------
+    shuffled_pos_idx : array
+        Integer array of shape (n_shuffles, n_spikes) with the position sample index of each shuffled spike
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    spike_times = np.sort(np.asarray(spike_times).flatten())
+    n_samples = len(pos_sample_times)
+
+    if shuffle_method == 'isi':
+        # Permute the inter-spike intervals independently for each shuffle, keeping the first spike time
+        isis = np.broadcast_to(np.diff(spike_times), (n_shuffles, len(spike_times) - 1))
+        shuffled_isis = rng.permuted(isis, axis=1)
+        shuffled_times = spike_times[0] + np.hstack([np.zeros((n_shuffles, 1)), np.cumsum(shuffled_isis, axis=1)])
+        shuffled_pos_idx = bin_spikes_to_pos_samples(shuffled_times, pos_sample_times)
+
+    elif shuffle_method == 'shift':
+        # Find each spike's position sample once, then shift circularly in sample space
+        spike_pos_idx = bin_spikes_to_pos_samples(spike_times, pos_sample_times)
+        offsets = draw_shift_offsets(n_samples, pos_sampling_rate, n_shuffles, min_shift, rng)
+        shuffled_pos_idx = (spike_pos_idx[None, :] + offsets[:, None]) % n_samples
+
+    else:
+        raise ValueError("shuffle_method must be 'isi' or 'shift'")
+
+    return shuffled_pos_idx
+
+def make_shuffle_occupancy(pos_bin_idx, pos_sampling_rate):
+    """
+    Compute the occupancy map shared by the real and shuffled spike trains of a trial.
+
+    Parameters
+    ----------
+    pos_bin_idx : tuple
+        Tuple of x and y position bin index arrays
+    pos_sampling_rate : float
+        Sampling rate of the position data in Hz
+
+    Returns
+    -------
+    flat_pos_idx : array
+        Flat rate map bin index of each position sample, from make_occupancy_grid
+    pos_map : array
+        2D occupancy map in seconds, with shape (ny, nx)
+    """
+    flat_pos_idx, map_shape = make_occupancy_grid(pos_bin_idx)
+    pos_map = np.bincount(flat_pos_idx, minlength=map_shape[0] * map_shape[1]).reshape(map_shape) / pos_sampling_rate
+    return flat_pos_idx, pos_map
+
+def spatial_info_from_pos_idx(spike_pos_idx, flat_pos_idx, pos_map, alpha = 200, spike_rows = None, n_trains = None):
+    """
+    Calculate adaptively smoothed spatial information for many spike trains at once, given the position sample
+    index of each spike. All spike maps are built with one np.bincount and smoothed together with adaptive_smooth_multi.
+
+    Parameters
+    ----------
+    spike_pos_idx : array
+        Integer array of shape (n_trains, n_spikes) with the position sample index of each spike. If `spike_rows`
+        is given, a flat array of position sample indices for spike trains of different lengths
+    flat_pos_idx : array
+        Flat rate map bin index of each position sample, from make_shuffle_occupancy
+    pos_map : array
+        2D occupancy map in seconds, from make_shuffle_occupancy
+    alpha : float
+        Alpha parameter for adaptive smoothing
+    spike_rows : array, optional
+        Spike train index of each spike in a flat `spike_pos_idx`
+    n_trains : int, optional
+        Number of spike trains when `spike_rows` is given. Defaults to spike_rows.max() + 1
+
+    Returns
+    -------
+    bits_per_spike : array
+        Array of bits per spike for each spike train
+    bits_per_sec : array
+        Array of bits per second for each spike train
+    """
+    if spike_rows is None:
+        spike_pos_idx = np.atleast_2d(spike_pos_idx)
+        n_trains = spike_pos_idx.shape[0]
+        spike_rows = np.arange(n_trains)[:, None]
+    elif n_trains is None:
+        n_trains = int(spike_rows.max()) + 1
+
+    map_shape = pos_map.shape
+    n_bins = pos_map.size
+
+    # Build all spike maps with a single bincount over the combined (train, y, x) index
+    combined_idx = spike_rows * n_bins + flat_pos_idx[spike_pos_idx]
+    spike_maps = np.bincount(combined_idx.ravel(), minlength=n_trains * n_bins).astype(float)
+    spike_maps = spike_maps.reshape((n_trains,) + map_shape)
+    spike_maps[:, pos_map == 0] = 0
+
+    # Smooth all maps together, in the same (x, y) orientation as make_rate_maps.
+    # As in make_rate_maps, spatial information uses each map's smoothed position map
+    _, smoothed_pos, rate_maps, _ = adaptive_smooth_multi(spike_maps.transpose(0, 2, 1), pos_map.T, alpha, method='ring')
+    smoothed_pos[smoothed_pos == 0] = np.nan
+
+    return spatial_info(rate_maps, smoothed_pos)
+
+def sequential_test_decided(n_exceed, n_used, p_threshold = 0.05, confidence = 0.99):
+    """
+    Sequential Monte Carlo stopping rule for shuffle p-values.
+    A cluster is decided once the Clopper-Pearson confidence interval of its exceedance probability, given
+    `n_exceed` shuffles at or above the real value out of `n_used` shuffles, lies entirely above or below
+    `p_threshold`. Clearly non-spatial clusters stop after a handful of exceedances, much like the
+    Besag-Clifford rule, and clearly spatial clusters stop once enough shuffles have failed to exceed.
+
+    Parameters
+    ----------
+    n_exceed : array
+        Number of shuffles with bits per spike greater than or equal to the real value, per cluster
+    n_used : array
+        Number of shuffles run so far, per cluster
+    p_threshold : float
+        Significance threshold the p-value is compared against
+    confidence : float
+        Confidence level of the interval. Higher values stop later but make fewer wrong decisions
+
+    Returns
+    -------
+    decided : array
+        Boolean array, True for clusters whose p-value is confidently above or below `p_threshold`
+    """
+    from scipy.stats import beta
+
+    n_exceed = np.asarray(n_exceed)
+    n_used = np.asarray(n_used)
+    tail = (1 - confidence) / 2
+
+    # Clopper-Pearson bounds, with the conventional 0 and 1 limits when there are no (or only) exceedances
+    with np.errstate(invalid='ignore'):
+        lower = np.where(n_exceed > 0, beta.ppf(tail, n_exceed, n_used - n_exceed + 1), 0.0)
+        upper = np.where(n_exceed < n_used, beta.ppf(1 - tail, n_exceed + 1, n_used - n_exceed), 1.0)
+
+    return (upper < p_threshold) | (lower > p_threshold)
+
+def spatial_significance_vectorised(pos_sample_times, pos_bin_idx, pos_sampling_rate, spike_times_real, n_shuffles = 1000, shuffle_method = 'isi', min_shift = 20, alpha = 200, chunk_size = 100, adaptive = False, p_threshold = 0.05, confidence = 0.99, seed = None):
+    """
+    Calculate the significance of spatial information for a given cluster, as in spatial_significance, but with
+    all shuffles generated as a matrix and scored in batches rather than as separate joblib tasks.
+
+    Parameters
+    ----------
+    pos_sample_times : array
+        Array of time points at which position data was sampled
+    pos_bin_idx : array
+        Array of bin indices corresponding to x and y position data
+    pos_sampling_rate : float
+        Sampling rate of the position data in Hz
+    spike_times_real : array
+        Array of spike times for a given cluster
+    n_shuffles : int
+        Number of shuffles to perform
+    shuffle_method : str
+        'isi' (inter-spike interval permutation) or 'shift' (circular time shift). See shuffle_spike_pos_idx
+    min_shift : float
+        Minimum circular shift in seconds, used when shuffle_method is 'shift'
+    alpha : float
+        Alpha parameter for adaptive smoothing
+    chunk_size : int
+        Number of shuffles scored per batch, to bound memory use
+    adaptive : bool
+        If True, stop after any batch once sequential_test_decided finds the p-value is confidently above or
+        below `p_threshold`. `n_shuffles` is then the maximum number of shuffles
+    p_threshold : float
+        Significance threshold used by the adaptive stopping rule
+    confidence : float
+        Confidence level used by the adaptive stopping rule
+    seed : int or numpy.random.SeedSequence, optional
+        Seed for the shuffles, so that reruns give the same null distribution. Defaults to None (unseeded)
+
+    Returns
+    -------
+    p_value : float
+        Proportion of shuffles with bits per spike greater than or equal to the real value
+    bits_per_spike_z : float
+        Z-score of the real bits per spike against the shuffled distribution
+    bits_per_spike_shuffled : array
+        Array of bits per spike for each shuffle that was run. In adaptive mode its length is the number of shuffles used
+    """
+    rng = np.random.default_rng(make_seed_sequence(seed))
+    spike_times_real = np.sort(np.asarray(spike_times_real).flatten())
+
+    # Calculate real spatial info
+    flat_pos_idx, pos_map = make_shuffle_occupancy(pos_bin_idx, pos_sampling_rate)
+    real_pos_idx = bin_spikes_to_pos_samples(spike_times_real, pos_sample_times)
+    bits_per_spike_real, _ = spatial_info_from_pos_idx(real_pos_idx, flat_pos_idx, pos_map, alpha)
+
+    # Score shuffles in chunks
+    bits_per_spike_shuffled = np.zeros(n_shuffles)
+    for start in range(0, n_shuffles, chunk_size):
+        n_chunk = min(chunk_size, n_shuffles - start)
+        shuffled_pos_idx = shuffle_spike_pos_idx(spike_times_real, pos_sample_times, pos_sampling_rate, n_chunk,
+                                                 shuffle_method = shuffle_method, min_shift = min_shift, rng = rng)
+        bits_per_spike_shuffled[start:start + n_chunk], _ = spatial_info_from_pos_idx(shuffled_pos_idx, flat_pos_idx, pos_map, alpha)
+
+        # Stop early once the p-value is confidently above or below the threshold
+        n_used = start + n_chunk
+        if adaptive and sequential_test_decided(np.sum(bits_per_spike_shuffled[:n_used] >= bits_per_spike_real), n_used, p_threshold, confidence):
+            bits_per_spike_shuffled = bits_per_spike_shuffled[:n_used]
+            break
+
+    # Z-score and one-tailed p-value, as in spatial_significance
+    bits_per_spike_z = ((bits_per_spike_real - bits_per_spike_shuffled.mean()) / bits_per_spike_shuffled.std())[0]
+    p_value = np.sum(bits_per_spike_shuffled >= bits_per_spike_real) / len(bits_per_spike_shuffled)
+
+    return p_value, bits_per_spike_z, bits_per_spike_shuffled
+
+def compute_shift_shuffle_chunk(spike_pos_idx, offsets, flat_pos_idx, pos_map, alpha = 200):
+    """
+    Calculate bits per spike for a chunk of circular shift shuffles of one spike train.
+    Used as the unit of work for spatial_significance_population.
+
+    Parameters
+    ----------
+    spike_pos_idx : array
+        Position sample index of each real spike
+    offsets : array
+        Circular shift offsets, in position samples
+    flat_pos_idx : array
+        Flat rate map bin index of each position sample
+    pos_map : array
+        2D occupancy map in seconds
+    alpha : float
+        Alpha parameter for adaptive smoothing
+
+    Returns
+    -------
+    bits_per_spike_shuffled : array
+        Array of bits per spike for each shuffle in the chunk
+    """
+    shuffled_pos_idx = (spike_pos_idx[None, :] + offsets[:, None]) % len(flat_pos_idx)
+    bits_per_spike_shuffled, _ = spatial_info_from_pos_idx(shuffled_pos_idx, flat_pos_idx, pos_map, alpha)
+    return bits_per_spike_shuffled
+
+def save_shuffle_checkpoint(checkpoint_path, **arrays):
+    """
+    Save partial shuffle results to a .npz file. The file is written under a temporary name and then moved into
+    place, so an interruption while saving never leaves a corrupt checkpoint.
+
+    Parameters
+    ----------
+    checkpoint_path : str or Path
+        Path of the checkpoint file
+    **arrays
+        Arrays to save, passed to np.savez
+    """
+    checkpoint_path = Path(checkpoint_path)
+    temp_path = checkpoint_path.with_name(checkpoint_path.name + '.tmp')
+    with open(temp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temp_path, checkpoint_path)
+
+def spatial_significance_population(spike_data, binned_pos_data, n_shuffles = 1000, min_shift = 20, alpha = 200, n_jobs = -1, max_memory_gb = 2.0, adaptive = False, batch_size = 100, p_threshold = 0.05, confidence = 0.99, seed = None, checkpoint_path = None):
+    """
+    Calculate the significance of spatial information for every cluster in a trial at once.
+
+    All clusters share the real occupancy map and the same set of circular shift offsets, so the null for each
+    cell is built from identical shifts of the spike train relative to position. Shuffles are split into
+    (cluster, shuffle chunk) tasks that are run in a process pool, with chunk sizes chosen so that the
+    concurrently running tasks stay within `max_memory_gb`.
+
+    Parameters
+    ----------
+    spike_data : dict
+        Dictionary of {cluster: spike times} for one trial, i.e. transform_spike_data(...)[trial].
+        The full output of transform_spike_data is also accepted if it contains a single trial
+    binned_pos_data : tuple
+        Tuple of (pos_bin_idx, pos_sample_times, pos_sampling_rate), as returned by bin_pos_data_axona/dlc
+    n_shuffles : int
+        Number of shuffles to perform
+    min_shift : float
+        Minimum circular shift in seconds
+    alpha : float
+        Alpha parameter for adaptive smoothing
+    n_jobs : int or None
+        Number of worker processes, as for joblib.Parallel. -1 uses all CPUs
+    max_memory_gb : float
+        Approximate cap on the memory used by all concurrently running tasks, in GB
+    adaptive : bool
+        If True, a cluster stops after any batch once sequential_test_decided finds its p-value is confidently
+        above or below `p_threshold`. `n_shuffles` is then the maximum per cluster
+    batch_size : int
+        Number of shuffles per batch. Results are checkpointed after every batch
+    p_threshold : float
+        Significance threshold used by the adaptive stopping rule
+    confidence : float
+        Confidence level used by the adaptive stopping rule
+    seed : int or numpy.random.SeedSequence, optional
+        Seed for the shift offsets, so that reruns give the same null distributions. Defaults to None (unseeded)
+    checkpoint_path : str or Path, optional
+        Path of a .npz file to save partial shuffle results to after every batch. If the file already exists,
+        the run resumes from it, reusing its shift offsets and skipping the batches already done. A ValueError is
+        raised if the checkpoint was saved with different clusters, shuffle or adaptive stopping settings, or
+        (when `seed` is given) offsets not drawn from `seed`
+
+    Returns
+    -------
+    significance_df : pd.DataFrame
+        DataFrame indexed by cluster, with columns 'n_spikes', 'bits_per_spike', 'bits_per_sec',
+        'bits_per_spike_z', 'p_value' and 'n_shuffles' (the number of shuffles used for each cluster).
+        Clusters with fewer than 2 spikes get NaN
+    """
+    # Unwrap the output of transform_spike_data for a single trial
+    if len(spike_data) > 0 and all(isinstance(value, dict) for value in spike_data.values()):
+        if len(spike_data) != 1:
+            raise ValueError("spike_data contains more than one trial, please pass a single trial")
+        spike_data = next(iter(spike_data.values()))
+
+    pos_bin_idx, pos_sample_times, pos_sampling_rate = binned_pos_data
+    n_samples = len(pos_sample_times)
+
+    # Shared occupancy map and shift offsets for every cluster
+    flat_pos_idx, pos_map = make_shuffle_occupancy(pos_bin_idx, pos_sampling_rate)
+    offsets = draw_shift_offsets(n_samples, pos_sampling_rate, n_shuffles, min_shift, np.random.default_rng(make_seed_sequence(seed)))
+
+    clusters = list(spike_data.keys())
+    spike_pos_idx = {cluster: bin_spikes_to_pos_samples(np.sort(np.asarray(times).flatten()), pos_sample_times)
+                     for cluster, times in spike_data.items()}
+    valid_clusters = [cluster for cluster in clusters if len(spike_pos_idx[cluster]) >= 2]
+
+    significance_df = pd.DataFrame(np.nan, index=pd.Index(clusters, name='cluster'),
+                                   columns=['n_spikes', 'bits_per_spike', 'bits_per_sec', 'bits_per_spike_z', 'p_value', 'n_shuffles'])
+    significance_df['n_spikes'] = [len(spike_pos_idx[cluster]) for cluster in clusters]
+    if len(valid_clusters) == 0:
+        return significance_df
+
+    # Real spatial info for all clusters in one batch
+    real_pos_idx = np.concatenate([spike_pos_idx[cluster] for cluster in valid_clusters])
+    real_rows = np.repeat(np.arange(len(valid_clusters)), [len(spike_pos_idx[cluster]) for cluster in valid_clusters])
+    bits_per_spike_real, bits_per_sec_real = spatial_info_from_pos_idx(real_pos_idx, flat_pos_idx, pos_map, alpha,
+                                                                      spike_rows=real_rows, n_trains=len(valid_clusters))
+
+    # Size shuffle chunks so that the tasks running at once stay within the memory cap.
+    # Per shuffle, a task holds the shuffled indices and roughly a dozen map-sized working arrays
+    # A batch has at most one task per shuffle of each cluster, so no more workers than that run at once
+    n_workers = max(1, min(effective_n_jobs(n_jobs), len(valid_clusters) * batch_size))
+    memory_per_worker = max_memory_gb * 1e9 / n_workers
+    chunk_sizes = [int(np.clip(memory_per_worker // (8 * (2 * len(spike_pos_idx[cluster]) + 12 * pos_map.size)), 1, n_shuffles))
+                   for cluster in valid_clusters]
+
+    bits_per_spike_shuffled = np.full((len(valid_clusters), n_shuffles), np.nan)
+    n_used = np.zeros(len(valid_clusters), dtype=int)
+    active = np.arange(len(valid_clusters))
+    first_batch = 0
+
+    # Resume from a checkpoint of an interrupted run. Its settings must match, and if a seed is given, its offsets
+    # must be the ones drawn from that seed, so that one null never mixes shuffles from different settings
+    run_settings = dict(n_samples=n_samples, batch_size=batch_size, min_shift=min_shift, alpha=alpha, adaptive=adaptive,
+                        p_threshold=p_threshold, confidence=confidence)
+    if checkpoint_path is not None and Path(checkpoint_path).exists():
+        checkpoint = np.load(checkpoint_path, allow_pickle=False)
+        if (checkpoint['bits_per_spike_shuffled'].shape != bits_per_spike_shuffled.shape
+                or not np.array_equal(checkpoint['clusters'], np.asarray(valid_clusters))
+                or any(key not in checkpoint.files or checkpoint[key] != value for key, value in run_settings.items())
+                or (seed is not None and not np.array_equal(checkpoint['offsets'], offsets))):
+            raise ValueError(f"Checkpoint {checkpoint_path} does not match this run")
+        offsets = checkpoint['offsets']
+        bits_per_spike_shuffled = checkpoint['bits_per_spike_shuffled']
+        n_used = checkpoint['n_used']
+        active = checkpoint['active']
+        first_batch = int(checkpoint['next_batch_start'])
+
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for batch_start in range(first_batch, n_shuffles, batch_size):
+            if active.size == 0:
+                break
+            batch_stop = min(batch_start + batch_size, n_shuffles)
+
+            # Split the batch into (cluster, shuffle chunk) tasks for the clusters still running
+            tasks = [(i, start, min(start + chunk_sizes[i], batch_stop))
+                     for i in active for start in range(batch_start, batch_stop, chunk_sizes[i])]
+            results = parallel(delayed(compute_shift_shuffle_chunk)(spike_pos_idx[valid_clusters[i]], offsets[start:stop], flat_pos_idx, pos_map, alpha)
+                               for i, start, stop in tasks)
+            for (i, start, stop), result in zip(tasks, results):
+                bits_per_spike_shuffled[i, start:stop] = result
+            n_used[active] = batch_stop
+
+            # Drop clusters whose p-value is confidently above or below the threshold
+            if adaptive:
+                n_exceed = np.sum(bits_per_spike_shuffled[active] >= bits_per_spike_real[active, None], axis=1)
+                active = active[~sequential_test_decided(n_exceed, n_used[active], p_threshold, confidence)]
+
+            if checkpoint_path is not None:
+                save_shuffle_checkpoint(checkpoint_path, clusters=np.asarray(valid_clusters), offsets=offsets,
+                                        bits_per_spike_shuffled=bits_per_spike_shuffled, n_used=n_used, active=active,
+                                        next_batch_start=batch_stop, **run_settings)
+
+    # Z-score and one-tailed p-value over the shuffles used, as in spatial_significance
+    mean_shuffled = np.nanmean(bits_per_spike_shuffled, axis=1)
+    std_shuffled = np.nanstd(bits_per_spike_shuffled, axis=1)
+    significance_df.loc[valid_clusters, 'bits_per_spike'] = bits_per_spike_real
+    significance_df.loc[valid_clusters, 'bits_per_sec'] = bits_per_sec_real
+    significance_df.loc[valid_clusters, 'bits_per_spike_z'] = (bits_per_spike_real - mean_shuffled) / std_shuffled
+    significance_df.loc[valid_clusters, 'p_value'] = np.sum(bits_per_spike_shuffled >= bits_per_spike_real[:, None], axis=1) / n_used
+    significance_df.loc[valid_clusters, 'n_shuffles'] = n_used
+
+    return significance_df
@@ -212,11 +212,18 @@ def concat_cluster_info(folder):
     info_all.to_csv(f'{folder}/cluster_info_all.tsv', sep = '\t')
 
 
+# Axona .bin packet: 4-byte ID, 8 further header bytes, 20 bytes of position data, then the rest of the 432 bytes
+AXONA_BIN_PACKET_DTYPE = np.dtype([('packet_id', 'S4'),
+                                   ('packet_header', 'V8'),
+                                   ('pos_sample', '<u2', (10,)),
+                                   ('packet_data', 'V400')])
+
 def pos_from_bin(path):
     '''
     Function for generating an Axona .pos position tracking file directly from raw recording data
     Input required is the path to the .set and .bin file (including the trial name, without the file extension, both files must be in the same directory)
     The .pos file will be written into this directory, and should be the same format as those generated by DacqUSB
+    The .bin file is read as a memory map of 432-byte packets (AXONA_BIN_PACKET_DTYPE), with all position samples decoded at once
     Jake Swann, 2023
     '''
     
@@ -255,81 +262,40 @@ def pos_from_bin(path):
                'data_start'
                 ]
 
-    # read in data and extract position data
-    with open(f'{path}.bin', 'rb') as f:
-        data = f.read()
-
-    position_data = []
-    packetnums = []
-    timestamps = []
-    x1s = []
-    y1s = []
-    x2s = []
-    y2s = []
-    numpix1s = []
-    numpix2s = []
-    totalpixs = []
-
-    for i in range(432, len(data)-432, 432): #skip first packet because it can be bugged (says Jim)
-        packet = data[i:i+432]
-        packet_id = packet[0:4].decode('ascii')
-
-        if packet_id == 'ADU2':
-            pos_sample = packet[12:32]
-
-            #Flip digits in pos data for saving (this is how they are in the .pos relative to the .bin)
-            pos_first = pos_sample[::2]
-            pos_second = pos_sample[1::2]
-            pos_sample = []
-            for n, i in enumerate(pos_first):
-                pos_sample.append(pos_second[n])
-                pos_sample.append(pos_first[n])
-                
-            packetnums.append(int.from_bytes(bytes(pos_sample[0:2]), 'big'))
-            timestamps.append(int.from_bytes(bytes(pos_sample[2:4]), 'big'))
-            y1s.append(int.from_bytes(bytes(pos_sample[4:6]), 'big'))
-            x1s.append(int.from_bytes(bytes(pos_sample[6:8]), 'big'))
-            y2s.append(int.from_bytes(bytes(pos_sample[8:10]), 'big'))
-            x2s.append(int.from_bytes(bytes(pos_sample[10:12]), 'big'))
-            numpix1s.append(int.from_bytes(bytes(pos_sample[12:14]), 'big'))
-            numpix2s.append(int.from_bytes(bytes(pos_sample[14:16]), 'big'))
-            totalpixs.append(int.from_bytes(bytes(pos_sample[16:18]), 'big'))
-            
-            # the X and Y values are reversed piece-wise so lets switch the format from
-            # packet #, video timestamp, y1, x1, y2, x2, numpix1, numpix2, total_pix, unused value
-            # to
-            # packet #, video timestamp, x1, y1, x2, y2, numpix1, numpix2, total_pix, unused value
-            y1 = pos_sample[4:6]
-            x1 = pos_sample[6:8]
-            y2 = pos_sample[8:10]
-            x2 = pos_sample[10:12]
-            
-            pos_sample[4:6] = x1
-            pos_sample[6:8] = y1
-            pos_sample[8:10] = x2
-            pos_sample[10:12] = y2
-            
-            pos_sample = bytes(pos_sample)
+    # Memory-map the .bin file as 432-byte packets, up to but not including the last full packet
+    # (the packets read by the original range(432, len(data) - 432, 432) loop, plus the first)
+    n_packets = len(range(432, os.path.getsize(f'{path}.bin') - 432, 432)) + 1
+    if n_packets > 1:
+        packets = np.memmap(f'{path}.bin', dtype=AXONA_BIN_PACKET_DTYPE, mode='r', shape=(n_packets,))
+        # Skip first packet because it can be bugged (says Jim), and keep ADU2 packets only
+        adu2_packets = np.flatnonzero(packets['packet_id'][1:] == b'ADU2') + 1
+        # Drop every second sample because pos data is double-counted in the .bin file
+        pos_words = np.array(packets['pos_sample'][adu2_packets[::2]])
+        del packets
+    else:
+        pos_words = np.zeros((0, 10), dtype='<u2')
 
-    #         if len(position_data) < (trial_duration*50*2) +1:
-            position_data.append(pos_sample)
+    # Position words are byte-swapped in the .bin relative to the .pos, so they are read little-endian:
+    # packet #, video timestamp, y1, x1, y2, x2, numpix1, numpix2, total_pix, unused value
+    packetnums, timestamps, y1s, x1s, y2s, x2s, numpix1s, numpix2s, totalpixs = pos_words[:, :9].T.astype(np.int64)
 
-    # Drop every second sample because pos data is double-counted in the .bin file
-    position_data = position_data[::2]
+    # the X and Y values are reversed piece-wise so lets switch the format from
+    # packet #, video timestamp, y1, x1, y2, x2, numpix1, numpix2, total_pix, unused value
+    # to
+    # packet #, video timestamp, x1, y1, x2, y2, numpix1, numpix2, total_pix, unused value
+    # written big-endian, as in the .pos file
+    position_data = pos_words[:, [0, 1, 3, 2, 5, 4, 6, 7, 8, 9]].astype('>u2')
 
     # save position data to csv
     pos_df = pd.DataFrame([packetnums, timestamps, x1s, x2s, y1s, y2s, numpix1s, numpix2s, totalpixs], 
                           index = ['Packet Number', 'Timestamps', 'X1', 'X2', 'Y1', 'Y2', 'Pixels LED 1', 'Pixels LED 2', 'Total Pixels'])
-    pos_df = pos_df.iloc[:, ::2]
-    pos_df = pos_df.set_axis(range(pos_df.shape[1]), axis = 1)
     pos_df.to_csv(f'{path}_pos.csv')
 
     # save position data to binary file
     with open(f'{path}.pos', 'wb') as f:
         for line in header:
             f.write(line.encode())
-        for pos_sample in position_data:
-            f.write(pos_sample)
+        f.write(position_data.tobytes())
         f.write('\r\ndata_end\r\n'.encode())
 
         f.close()
@@ -0,0 +1,71 @@
+"""
+Time the 'convolve' and 'ring' methods of adaptive smoothing on simulated maps.
+
+Run as a script, with the package importable as spelt:
+    python benchmarks/bench_adaptive_smooth.py
+"""
+import time
+import numpy as np
+import pandas as pd
+from spelt.maps.adaptive_smooth import adaptive_smooth, adaptive_smooth_multi
+
+def benchmark_adaptive_smooth(map_sizes=(20, 40, 80, 160), alphas=(50, 200, 1000), n_maps=1, occupancy_fraction=0.5, n_repeats=3, seed=0):
+    """
+    Compare the run time of the 'convolve' and 'ring' methods of adaptive smoothing on simulated maps.
+
+    Simulated position maps are square, with a random subset of bins visited, and spike maps are drawn
+    from a Poisson distribution in the visited bins. Sparse occupancy and small alpha values push the
+    smoothing to large radii, where the ring method is expected to be fastest.
+
+    Args:
+        map_sizes (iterable of int): Side length of the square maps to test, in bins.
+        alphas (iterable of float): Alpha parameters to test.
+        n_maps (int, optional): Number of spike maps to smooth. If 1, adaptive_smooth is timed, otherwise
+                                adaptive_smooth_multi is timed on a stack of maps. Defaults to 1.
+        occupancy_fraction (float, optional): Fraction of bins that are visited. Defaults to 0.5.
+        n_repeats (int, optional): Number of repeats per condition. The fastest run is reported. Defaults to 3.
+        seed (int, optional): Seed for the simulated maps. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: One row per (map_size, alpha) with the best run time of each method in seconds,
+                      the speedup of 'ring' over 'convolve', and whether the outputs are identical.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for map_size in map_sizes:
+        pos_map = rng.integers(1, 50, (map_size, map_size)) / 50
+        pos_map[rng.random((map_size, map_size)) > occupancy_fraction] = 0
+        spk_maps = rng.poisson(0.1, (n_maps, map_size, map_size)).astype(float)
+        spk_maps[:, pos_map == 0] = 0
+
+        for alpha in alphas:
+            timings = {}
+            outputs = {}
+            for method in ('convolve', 'ring'):
+                run_times = []
+                for _ in range(n_repeats):
+                    start = time.perf_counter()
+                    if n_maps == 1:
+                        outputs[method] = adaptive_smooth(spk_maps[0], pos_map, alpha, method=method)
+                    else:
+                        outputs[method] = adaptive_smooth_multi(spk_maps, pos_map, alpha, method=method)
+                    run_times.append(time.perf_counter() - start)
+                timings[method] = min(run_times)
+
+            identical = all(np.array_equal(a, b, equal_nan=True) for a, b in zip(outputs['convolve'], outputs['ring']))
+            rows.append({'map_size': map_size,
+                         'alpha': alpha,
+                         'convolve_s': timings['convolve'],
+                         'ring_s': timings['ring'],
+                         'speedup': timings['convolve'] / timings['ring'],
+                         'identical': identical})
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    pd.set_option('display.width', 120)
+    print('Single map (adaptive_smooth)')
+    print(benchmark_adaptive_smooth(n_maps=1))
+    print('Stack of 50 maps (adaptive_smooth_multi)')
+    print(benchmark_adaptive_smooth(n_maps=50))
@@ -18,6 +18,70 @@ def create_circular_kernel(radius):
     kernel[mask] = 1
     return kernel
 
+def create_ring_offsets(radius):
+    """
+    Find the offsets of the bins that are inside the circular kernel of `radius`, but not inside the kernel of `radius - 1`.
+
+    Args:
+        radius (int): Outer radius of the ring.
+
+    Returns:
+        tuple: Two 1D integer arrays of (y, x) offsets from the kernel centre.
+    """
+    x, y = np.ogrid[-radius:radius+1, -radius:radius+1]
+    distance = x**2 + y**2
+    ring = (distance <= radius**2) & (distance > (radius - 1)**2)
+    dy, dx = np.nonzero(ring)
+    return dy - radius, dx - radius
+
+class RunningDiskSum:
+    """
+    Running sum of one or more maps over a flat, circular kernel, grown one radius at a time.
+
+    Gives the same result as convolving with create_circular_kernel(radius) and zero padding, but each call to
+    grow() only adds the ring of bins between radius - 1 and radius. The cost of each step therefore grows with
+    the radius rather than with its square.
+
+    Args:
+        maps (ndarray): 2D map, or stack of maps with the map axes last, e.g. (n_maps, ny, nx).
+        max_radius (int): Largest radius the sum will be grown to.
+    """
+    def __init__(self, maps, max_radius):
+        self.radius = 0
+        self.pad = max(int(max_radius), 0)
+        self.shape = maps.shape[-2:]
+        pad_width = [(0, 0)] * (maps.ndim - 2) + [(self.pad, self.pad)] * 2
+        self.padded = np.pad(maps, pad_width, mode='constant', constant_values=0)
+        # The kernel of radius 0 is the centre bin only
+        self.disk_sum = np.array(maps, copy=True)
+
+    def grow(self, index=None):
+        """
+        Increase the kernel radius by one and return the updated disk sums.
+
+        Args:
+            index (ndarray, optional): Indices along the first axis of a map stack to update. Maps that are left out
+                                       are not updated, and should not be used again. Defaults to all maps.
+
+        Returns:
+            ndarray: Disk sums at the new radius, for the maps selected by `index`.
+        """
+        self.radius += 1
+        if self.radius > self.pad:
+            raise ValueError(f"Radius {self.radius} is larger than the max_radius of {self.pad}")
+
+        padded = self.padded if index is None else self.padded[index]
+        ny, nx = self.shape
+        ring_sum = np.zeros(padded.shape[:-2] + self.shape, dtype=self.disk_sum.dtype)
+        for dy, dx in zip(*create_ring_offsets(self.radius)):
+            ring_sum += padded[..., self.pad + dy:self.pad + dy + ny, self.pad + dx:self.pad + dx + nx]
+
+        if index is None:
+            self.disk_sum += ring_sum
+            return self.disk_sum
+        self.disk_sum[index] += ring_sum
+        return self.disk_sum[index]
+
 def update_smoothed_maps(smoothed_spk, smoothed_pos, f_spk, f_pos, f_vis, bins_passed):
     """
     Update the smoothed spike and position maps.
@@ -65,7 +129,7 @@ def handle_empty_maps(spk_map, pos_map):
     nan_map = np.full_like(pos_map, np.nan)
     return nan_map, nan_map, nan_map, np.nan
 
-def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
+def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None, method='convolve'):
     """
     Apply adaptive smoothing to rate maps using a flat, circular kernel.
     Built to match the logic of scan(pix).maps.adaptiveSmooth.m by Thomas Wills
@@ -76,6 +140,11 @@ def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
         alpha (float): Alpha parameter for adaptive smoothing.
         max_radius (int, optional): Maximum allowed radius for the smoothing kernel. 
                                     Defaults to half of the smallest map dimension.
+        method (str, optional): 'convolve' builds a new circular kernel and convolves every map at every radius.
+                                'ring' keeps running disk sums of the spike map and visited template, and only adds
+                                the ring of bins at each new radius. The position map is still convolved at every
+                                radius, so this saves two of the three convolutions. It gives identical results for
+                                spike count maps (see benchmarks/bench_adaptive_smooth.py). Defaults to 'convolve'.
 
     Returns:
         smoothed_spk (ndarray): Smoothed spike map.
@@ -85,6 +154,8 @@ def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
     """
     if max_radius is None:
         max_radius = min(spk_map.shape) // 2
+    if method not in ('convolve', 'ring'):
+        raise ValueError("method must be 'convolve' or 'ring'")
 
     # Check for empty spike map
     if np.sum(spk_map) == 0:
@@ -97,6 +168,10 @@ def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
     smoothed_check = (pos_map == 0)  # True for unvisited bins
     radii_used_list = []
 
+    if method == 'ring':
+        spk_sums = RunningDiskSum(spk_map, max_radius)
+        vis_sums = RunningDiskSum(visited_template, max_radius)
+
     # Main adaptive smoothing loop
     radius = 1
     while not np.all(smoothed_check):
@@ -104,13 +179,18 @@ def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
         if radius > max_radius:
             break
 
-        # Construct filter kernel
-        kernel = create_circular_kernel(radius)
-
         # Filter maps to get number of spikes and sum of positions within the kernel
-        f_spk = convolve(spk_map, kernel, mode='constant', cval=0.0)
+        # The position map is always convolved, as its sums are not exact in floating point and the
+        # pass criterion must match the convolution order exactly. Spike counts and the visited template
+        # are integer valued, so their running ring sums are exact.
+        kernel = create_circular_kernel(radius)
         f_pos = convolve(pos_map, kernel, mode='constant', cval=0.0)
-        f_vis = convolve(visited_template, kernel, mode='constant', cval=0.0)
+        if method == 'ring':
+            f_spk = spk_sums.grow()
+            f_vis = vis_sums.grow()
+        else:
+            f_spk = convolve(spk_map, kernel, mode='constant', cval=0.0)
+            f_vis = convolve(visited_template, kernel, mode='constant', cval=0.0)
 
         # Determine which bins meet the criteria at this radius
         with np.errstate(divide='ignore'):
@@ -134,3 +214,103 @@ def adaptive_smooth(spk_map, pos_map, alpha, max_radius=None):
     median_radius = np.nanmedian(radii_used_list)
 
     return smoothed_spk, smoothed_pos, smoothed_rate, median_radius
+
+
+def adaptive_smooth_multi(spk_maps, pos_map, alpha, max_radius=None, method='convolve'):
+    """
+    Apply adaptive smoothing to a stack of spike maps that share one position map.
+    Gives the same result as calling adaptive_smooth on each spike map in turn, but the position and
+    visited-template convolutions are computed once per radius and shared between all maps, and the
+    whole stack is convolved in one call per radius. Maps are dropped from the working set once all of
+    their visited bins have passed the smoothing criterion.
+
+    Args:
+        spk_maps (ndarray): 3D array of spike maps with shape (n_maps, ny, nx).
+        pos_map (ndarray): 2D array representing the shared position map, with shape (ny, nx).
+        alpha (float): Alpha parameter for adaptive smoothing.
+        max_radius (int, optional): Maximum allowed radius for the smoothing kernel.
+                                    Defaults to half of the smallest map dimension.
+        method (str, optional): 'convolve' or 'ring', as in adaptive_smooth. Defaults to 'convolve'.
+
+    Returns:
+        smoothed_spk (ndarray): Smoothed spike maps, shape (n_maps, ny, nx).
+        smoothed_pos (ndarray): Smoothed position maps, one per spike map, shape (n_maps, ny, nx).
+        smoothed_rate (ndarray): Smoothed rate maps, shape (n_maps, ny, nx).
+        median_radius (ndarray): Median radius used in the smoothing process for each map.
+    """
+    spk_maps = np.asarray(spk_maps, dtype=float)
+    n_maps = spk_maps.shape[0]
+
+    if max_radius is None:
+        max_radius = min(pos_map.shape) // 2
+    if method not in ('convolve', 'ring'):
+        raise ValueError("method must be 'convolve' or 'ring'")
+
+    # Initializations
+    smoothed_spk = np.zeros_like(spk_maps)
+    smoothed_pos = np.zeros_like(spk_maps)
+    visited_template = (pos_map > 0).astype(int)
+    smoothed_check = np.broadcast_to(pos_map == 0, spk_maps.shape).copy()  # True for unvisited bins
+    radius_counts = np.zeros((n_maps, max_radius + 1), dtype=int)  # Number of bins smoothed at each radius
+
+    # Empty spike maps are handled separately and never enter the working set
+    empty_maps = np.sum(spk_maps, axis=(1, 2)) == 0
+    active = np.flatnonzero(~empty_maps)
+
+    if method == 'ring':
+        spk_sums = RunningDiskSum(spk_maps, max_radius)
+        vis_sums = RunningDiskSum(visited_template, max_radius)
+
+    # Main adaptive smoothing loop
+    radius = 1
+    while active.size > 0:
+        # Check if radius is getting too big
+        if radius > max_radius:
+            break
+
+        # Shared position and visited sums, then one filtering step over all active spike maps
+        # (the position map is always convolved, see adaptive_smooth)
+        kernel = create_circular_kernel(radius)
+        f_pos = convolve(pos_map, kernel, mode='constant', cval=0.0)
+        if method == 'ring':
+            f_vis = vis_sums.grow()
+            f_spk = spk_sums.grow(active)
+        else:
+            f_vis = convolve(visited_template, kernel, mode='constant', cval=0.0)
+            f_spk = convolve(spk_maps[active], kernel[None, :, :], mode='constant', cval=0.0)
+
+        # Determine which bins meet the criteria at this radius
+        with np.errstate(divide='ignore'):
+            bins_passed = np.logical_and(f_pos != 0, (alpha / (np.sqrt(f_spk) * f_pos)) <= radius)
+        bins_passed &= ~smoothed_check[active]
+
+        # Update smoothed maps and record bins
+        map_idx, y_idx, x_idx = np.nonzero(bins_passed)
+        smoothed_spk[active[map_idx], y_idx, x_idx] = f_spk[map_idx, y_idx, x_idx] / f_vis[y_idx, x_idx]
+        smoothed_pos[active[map_idx], y_idx, x_idx] = f_pos[y_idx, x_idx] / f_vis[y_idx, x_idx]
+        smoothed_check[active[map_idx], y_idx, x_idx] = True
+
+        # Record radii used
+        radius_counts[active, radius] = np.sum(bins_passed, axis=(1, 2))
+
+        # Drop maps where every bin has been smoothed
+        active = active[~np.all(smoothed_check[active], axis=(1, 2))]
+
+        # Increase circle radius
+        radius += 1
+
+    # Finalizing smoothed rate maps
+    with np.errstate(divide='ignore', invalid='ignore'):
+        smoothed_rate = smoothed_spk / smoothed_pos
+    smoothed_rate[:, pos_map == 0] = np.nan
+
+    # Compute median filter radius for each map
+    radii = np.arange(max_radius + 1)
+    median_radius = np.array([np.median(np.repeat(radii, counts)) if counts.any() else np.nan for counts in radius_counts])
+
+    # Empty maps are returned as NaN, as in handle_empty_maps
+    smoothed_spk[empty_maps] = np.nan
+    smoothed_pos[empty_maps] = np.nan
+    smoothed_rate[empty_maps] = np.nan
+
+    return smoothed_spk, smoothed_pos, smoothed_rate, median_radius
@@ -106,6 +106,132 @@ def make_rate_maps(spike_data, pos_sample_times, pos_bin_idx, pos_sampling_rate,
         return rate_maps_dict, pos_map
 
 
+def bin_spikes_to_pos_samples(spike_times, pos_sample_times):
+    """
+    Find the index of the position sample preceding each spike, matching the binning used in make_rate_maps.
+
+    Args:
+        spike_times (ndarray): 1D array of spike times in seconds.
+        pos_sample_times (ndarray): 1D array of position sample times in seconds.
+
+    Returns:
+        ndarray: 1D integer array of position sample indices, one per spike.
+    """
+    return np.digitize(spike_times, pos_sample_times) - 1
+
+
+def make_occupancy_grid(pos_bin_idx):
+    """
+    Flatten 2D position bin indices onto the (ny, nx) grid used for rate maps.
+
+    The grid matches the bins used by np.histogram2d in make_rate_maps, where the bin edges run from
+    0 to the maximum bin index, so the highest index falls into the last bin along each axis.
+
+    Args:
+        pos_bin_idx (tuple): Tuple of (x_bin_idx, y_bin_idx) arrays, as returned by bin_pos_data_axona/dlc.
+
+    Returns:
+        tuple:
+            - flat_pos_idx (ndarray): 1D array of flat (y * nx + x) grid indices, one per position sample.
+            - map_shape (tuple): Shape of the rate map grid, (ny, nx).
+    """
+    nx = max(int(pos_bin_idx[0].max()), 1)
+    ny = max(int(pos_bin_idx[1].max()), 1)
+
+    x_idx = np.clip(pos_bin_idx[0], 0, nx - 1)
+    y_idx = np.clip(pos_bin_idx[1], 0, ny - 1)
+    flat_pos_idx = y_idx.astype(np.int64) * nx + x_idx
+
+    return flat_pos_idx, (ny, nx)
+
+
+def make_rate_maps_batched(spike_times, spike_clusters, pos_sample_times, pos_bin_idx, pos_sampling_rate, clusters = None, dt = 1.0, adaptive_smoothing = True, alpha = 200):
+    """
+    Generate rate maps for all clusters at once from flat spike time and cluster arrays.
+
+    Every spike map is built with a single np.bincount over a combined (cluster, y, x) index, so the cost
+    no longer scales with a Python loop over clusters. The output is a contiguous stack of rate maps that
+    shares one occupancy map, already in the (y, x) orientation returned by make_rate_maps.
+
+    Unlike make_rate_maps, every cluster is smoothed against the raw occupancy map, rather than the smoothed
+    position map of the previous cluster.
+
+    Args:
+        spike_times (ndarray): 1D array of spike times in seconds, for all clusters.
+        spike_clusters (ndarray): 1D array of cluster IDs, one per spike.
+        pos_sample_times (ndarray): A 1D NumPy array representing the sample times of the animal's position.
+        pos_bin_idx (tuple): Tuple of (x_bin_idx, y_bin_idx) arrays of position bin indices.
+        pos_sampling_rate (float): The sampling rate of the animal's position in Hz.
+        clusters (array-like, optional): Cluster IDs to make maps for, in output order. Clusters without spikes
+                                         get an empty map. Defaults to the unique values of `spike_clusters`.
+        dt (float, optional): The time step in seconds for binning the spike data. Defaults to 1.0.
+        adaptive_smoothing (bool, optional): Whether to use adaptive smoothing. Defaults to True.
+        alpha (float, optional): The alpha parameter for adaptive smoothing. Defaults to 200.
+
+    Returns:
+        tuple: A tuple containing the following elements:
+            - rate_maps (ndarray): A 3D array of rate maps with shape (n_clusters, ny, nx).
+            - pos_map (ndarray): A 2D occupancy map in seconds with shape (ny, nx), NaN where occupancy is 0.
+            - cluster_ids (ndarray): Cluster ID for each map in `rate_maps`.
+    """
+    spike_times = np.asarray(spike_times).flatten()
+    spike_clusters = np.asarray(spike_clusters).flatten()
+    cluster_ids = np.unique(spike_clusters) if clusters is None else np.asarray(clusters)
+    n_clusters = len(cluster_ids)
+
+    flat_pos_idx, map_shape = make_occupancy_grid(pos_bin_idx)
+    n_bins = map_shape[0] * map_shape[1]
+
+    # Compute the 2D occupancy map, in seconds per bin
+    pos_map = np.bincount(flat_pos_idx, minlength=n_bins).reshape(map_shape) / pos_sampling_rate
+
+    # Map each spike onto its row in the output stack, dropping clusters that were not requested
+    sort_order = np.argsort(cluster_ids, kind='stable')
+    sorted_ids = cluster_ids[sort_order]
+    row = np.searchsorted(sorted_ids, spike_clusters)
+    row = np.clip(row, 0, max(n_clusters - 1, 0))
+    valid_spikes = (sorted_ids[row] == spike_clusters) if n_clusters > 0 else np.zeros(len(spike_clusters), dtype=bool)
+    row = sort_order[row[valid_spikes]]
+
+    # Build every spike map with a single bincount over the combined (cluster, y, x) index
+    binned_spikes = bin_spikes_to_pos_samples(spike_times[valid_spikes], pos_sample_times)
+    combined_idx = row * n_bins + flat_pos_idx[binned_spikes]
+    spike_maps = np.bincount(combined_idx, minlength=n_clusters * n_bins).astype(float)
+    spike_maps = spike_maps.reshape((n_clusters,) + map_shape)
+
+    # Set spike count to 0 where occupancy is 0 to avoid division by 0
+    spike_maps[:, pos_map == 0] = 0
+
+    if adaptive_smoothing:
+        # Smooth all spike maps together, sharing the occupancy convolutions. Maps are smoothed in the (x, y)
+        # orientation that make_rate_maps uses, so that the convolution sums are accumulated in the same order
+        _, _, rate_maps, _ = adaptive_smooth_multi(spike_maps.transpose(0, 2, 1), pos_map.T, alpha, method='ring')
+        rate_maps = np.ascontiguousarray(rate_maps.transpose(0, 2, 1))
+    else:
+        # Calculate the raw rate map by dividing spike count by occupancy time (plus a small constant)
+        rate_maps = spike_maps / (pos_map * dt + 1e-10)
+
+    # Set pos map to NaN where occupancy is 0
+    pos_map[pos_map == 0] = np.nan
+
+    return rate_maps, pos_map, cluster_ids
+
+
+def rate_map_stack_to_dict(rate_maps, cluster_ids):
+    """
+    Convert a stack of rate maps into the {cluster: rate_map} dictionary format used by make_rate_maps.
+    The dictionary values are views into the stack, so no data is copied.
+
+    Args:
+        rate_maps (ndarray): 3D array of rate maps with shape (n_clusters, ny, nx).
+        cluster_ids (array-like): Cluster ID for each map in `rate_maps`.
+
+    Returns:
+        dict: A dictionary with cluster IDs as keys and 2D rate maps as values.
+    """
+    return {cluster: rate_maps[i] for i, cluster in enumerate(cluster_ids)}
+
+
 def plot_cluster_across_session(rate_maps_dict, cluster_id, **kwargs):
     """
     Plots rate maps for a given cluster across multiple trials.
@@ -408,11 +534,23 @@ def make_rate_maps_from_obj(obj):
         else:
             raise ValueError('Recording type not recognised')
 
-        rate_maps[trial], pos_map[trial], max_rates[trial], mean_rates[trial] = make_rate_maps(spike_data = current_trial_spikes_filtered,
-                                   pos_sample_times= pos_sample_times[trial],
-                                   pos_bin_idx = pos_bin_idx[trial], 
+        # Flatten the filtered spikes so that all clusters can be mapped in one batch
+        cluster_ids = np.array(list(current_trial_spikes_filtered.keys()))
+        flat_spike_times = np.concatenate([np.asarray(t) for t in current_trial_spikes_filtered.values()]) if len(cluster_ids) > 0 else np.array([])
+        flat_spike_clusters = np.repeat(cluster_ids, [len(t) for t in current_trial_spikes_filtered.values()])
+
+        rate_map_stack, pos_map[trial], cluster_ids = make_rate_maps_batched(spike_times = flat_spike_times,
+                                   spike_clusters = flat_spike_clusters,
+                                   pos_sample_times = pos_sample_times[trial],
+                                   pos_bin_idx = pos_bin_idx[trial],
                                    pos_sampling_rate = pos_sampling_rate[trial],
+                                   clusters = cluster_ids,
                                    adaptive_smoothing = True,
                                    alpha = 200)
-        
+        rate_maps[trial] = rate_map_stack_to_dict(rate_map_stack, cluster_ids)
+
+        # Calculate max and mean firing rates
+        max_rates[trial] = dict(zip(cluster_ids, np.nanmax(rate_map_stack, axis=(1, 2)))) if len(cluster_ids) > 0 else {}
+        mean_rates[trial] = dict(zip(cluster_ids, np.nanmean(rate_map_stack, axis=(1, 2)))) if len(cluster_ids) > 0 else {}
+
     return rate_maps, pos_map, max_rates, mean_rates, spike_times, pos_bin_idx, pos_sample_times, pos_sampling_rate
\ No newline at end of file
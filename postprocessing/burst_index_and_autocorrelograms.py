@@ -1,94 +1,207 @@
 import numpy as np
-def compute_autocorrelograms_and_first_moment(spike_times, spike_clusters, bin_size, time_window): #, burst_threshold):
+
+def make_sweep_times(spike_times, spike_groups, time_window):
     """
-    Adapted function to compute autocorrelograms, burst indices, and first moments (in ms) for multiple clusters, 
-    returning them as separate dictionaries. Includes acWin to constrain bins for first moment calculation.
+    Offset spike times by group, so that a sweep over the sorted result never finds pairs across groups.
+    Spikes must be sorted by group and then by time. Returns spike_times unchanged if spike_groups is None.
+    """
+    if spike_groups is None or len(spike_times) == 0:
+        return spike_times
+    group_offset = np.ptp(spike_times) + 2 * time_window + 1
+    return spike_times + (np.asarray(spike_groups) - spike_groups[0]) * group_offset
+
+def expand_ranges(starts, lengths):
+    """
+    Concatenate the integer ranges starts[i]:starts[i] + lengths[i] into one array, without a Python loop.
+    """
+    range_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + np.arange(lengths.sum()) - range_offsets
+
+def assign_cluster_rows(spike_clusters, cluster_ids):
+    """
+    Find the row (position in cluster_ids) of each spike's cluster.
+    Returns the rows and a mask of spikes whose cluster is in cluster_ids (rows of other spikes are not meaningful).
+    """
+    if cluster_ids.size == 0:
+        return np.zeros(len(spike_clusters), dtype=int), np.zeros(len(spike_clusters), dtype=bool)
+    sorter = np.argsort(cluster_ids)
+    cluster_positions = np.searchsorted(cluster_ids, spike_clusters, sorter=sorter)
+    spike_rows = sorter[np.minimum(cluster_positions, len(cluster_ids) - 1)]
+    return spike_rows, cluster_ids[spike_rows] == spike_clusters
+
+def bin_lags(lags, bin_edges):
+    """
+    Bin index of each lag as np.histogram assigns them (the last bin includes its right edge), or -1 if out of range.
+    """
+    lag_bins = np.searchsorted(bin_edges, lags, side='right') - 1
+    lag_bins[lags == bin_edges[-1]] = len(bin_edges) - 2
+    lag_bins[lag_bins >= len(bin_edges) - 1] = -1
+    return lag_bins
+
+def find_spike_pairs_in_window(spike_times, time_window, spike_groups=None, max_pairs=10_000_000):
+    """
+    Sweep over sorted spike times and yield every pair of spikes, within the same group, that are at most
+    time_window apart. For each spike, the last spike inside the window is found with np.searchsorted, so
+    only pairs inside the window are generated. Pairs are yielded in blocks of at most about max_pairs.
+    
+    Parameters:
+    - spike_times (numpy array): Spike times in seconds, sorted by group and then by time.
+    - time_window (float): Maximum time between the spikes of a pair, in seconds.
+    - spike_groups (numpy array, optional): Integer group of each spike (e.g. cluster, or cluster and trial). Default is None (one group).
+    - max_pairs (int): Approximate maximum number of pairs per block, to bound memory. Default is 10 million.
+    
+    Yields:
+    - first, second (numpy arrays): Indices of the earlier and later spike of each pair (first < second).
+    """
+    spike_times = np.asarray(spike_times, dtype=float)
+    n_spikes = len(spike_times)
+    if n_spikes == 0:
+        return
+    
+    # Offset each group in time so that windows never cross group boundaries
+    sweep_times = make_sweep_times(spike_times, spike_groups, time_window)
+    
+    # Number of later spikes within the window of each spike
+    window_ends = np.searchsorted(sweep_times, sweep_times + time_window, side='right')
+    n_later = window_ends - np.arange(n_spikes) - 1
+    
+    # Split spikes into blocks of at most about max_pairs pairs
+    cumulative_pairs = np.cumsum(n_later)
+    block_edges = np.searchsorted(cumulative_pairs, np.arange(max_pairs, cumulative_pairs[-1], max_pairs), side='left')
+    block_edges = np.unique(np.concatenate([[0], block_edges + 1, [n_spikes]]))
+    
+    for block_start, block_stop in zip(block_edges[:-1], block_edges[1:]):
+        block_n_later = n_later[block_start:block_stop]
+        n_pairs = block_n_later.sum()
+        if n_pairs == 0:
+            continue
+        
+        # first: each spike repeated once per later spike; second: first + 1, first + 2, ...
+        block_spikes = np.arange(block_start, block_stop)
+        yield np.repeat(block_spikes, block_n_later), expand_ranges(block_spikes + 1, block_n_later)
+
+def compute_autocorrelogram_matrix(spike_times, spike_clusters, bin_size, time_window, spike_trials=None, clusters=None, max_pairs=10_000_000):
+    """
+    Compute the autocorrelograms of all clusters at once, from every pair of spikes (not only consecutive ones)
+    within time_window of each other. Spikes are sorted by (cluster, time) once, pairs are found with a windowed
+    sweep (find_spike_pairs_in_window), and all clusters are histogrammed together with a single np.bincount.
+    Each pair is counted at both +lag and -lag, so autocorrelograms are symmetric.
     
     Parameters:
     - spike_times (numpy array): Array of spike times in seconds.
     - spike_clusters (numpy array): Array of cluster IDs corresponding to each spike time.
     - bin_size (float): The size of the bins for the autocorrelogram in seconds.
-    - time_window (float): The time window around each spike to consider for autocorrelation and first moment in seconds.
+    - time_window (float): The time window around each spike to consider for autocorrelation in seconds.
+    - spike_trials (numpy array, optional): Trial of each spike. If given, only spikes in the same trial are paired,
+      as spike times from ephys.load_spikes restart at each trial. Default is None.
+    - clusters (array-like, optional): Cluster IDs to include, in output order. Default is all clusters, sorted.
+    - max_pairs (int): Approximate maximum number of spike pairs held in memory at once. Default is 10 million.
     
     Returns:
-    - autocorrelograms (dict): A dictionary containing the bin centers and counts for each cluster's autocorrelogram.
-    - burst_indices (dict): A dictionary containing the burst index for each cluster
-    - first_moments (dict): A dictionary containing the first moment for each cluster's autocorrelogram (in ms).
+    - autocorrelograms (numpy array): Counts of shape (n_clusters, n_bins).
+    - bin_centers (numpy array): Centre of each bin, in seconds.
+    - cluster_ids (numpy array): Cluster ID of each row.
     """
     # Define the bin edges for the histogram (common for all clusters)
     bin_edges = np.arange(-time_window, time_window + bin_size, bin_size)
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    n_bins = len(bin_centers)
     
-    # Initialize dictionaries for storing results
-    autocorrelograms = {}
-    burst_indices = {}
-    first_moments = {}
+    spike_times = np.asarray(spike_times, dtype=float)
+    spike_clusters = np.asarray(spike_clusters)
+    cluster_ids = np.unique(spike_clusters) if clusters is None else np.asarray(clusters)
+    n_clusters = len(cluster_ids)
     
-    # Identify unique clusters
-    unique_clusters = np.unique(spike_clusters)
+    # Row of each spike's cluster, dropping spikes from other clusters
+    spike_rows, included = assign_cluster_rows(spike_clusters, cluster_ids)
     
-    for cluster in unique_clusters:
-        # Extract spike times for the current cluster
-        cluster_spike_times = spike_times[spike_clusters == cluster]
-        
-        # Sort spike times
-        cluster_spike_times.sort()
-        
-        # Compute differences between consecutive spike times
-        time_diffs = np.diff(cluster_spike_times)
-        
-        # Filter time differences within the specified time window
-        time_diffs = time_diffs[np.abs(time_diffs) <= time_window]
-        
-        # Compute the histogram for autocorrelogram
-        counts, _ = np.histogram(time_diffs, bins=bin_edges)
-        
-        # Calculate the centers of the bins for autocorrelogram
-        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-        
-        # Store autocorrelogram in dictionary
-        autocorrelograms[cluster] = {'bin_centers': bin_centers, 'counts': counts}
-        
-        ### Compute the first moment (mean) of the autocorrelogram, in milliseconds
-        fm_bin_centers = bin_centers * 1000 # Convert bin centres to milliseconds
+    spike_times, spike_rows = spike_times[included], spike_rows[included]
+    spike_groups = spike_rows
+    if spike_trials is not None:
+        spike_trials = np.asarray(spike_trials)[included]
+        spike_groups = spike_rows * (int(spike_trials.max()) + 1) + spike_trials
+    
+    # Sort spikes by (group, time) once
+    order = np.lexsort((spike_times, spike_groups))
+    spike_times, spike_rows, spike_groups = spike_times[order], spike_rows[order], spike_groups[order]
+    
+    # Search one bin beyond time_window: the group offsets in the sweep round spike times, so pairs at exactly
+    # time_window are kept or dropped by bin_lags on their true lag instead
+    flat_counts = np.zeros(n_clusters * n_bins, dtype=np.int64)
+    for first, second in find_spike_pairs_in_window(spike_times, time_window + bin_size, spike_groups, max_pairs):
+        lags = spike_times[second] - spike_times[first]
+        pair_rows = spike_rows[first] * n_bins
         
-        # Filter bins where bin centers are positive
-        positive_indices = np.where(fm_bin_centers > 0)[0]
-        positive_bin_centers = fm_bin_centers[positive_indices]
-        positive_counts = counts[positive_indices]
+        # Bin +lag and -lag as np.histogram does
+        for signed_lags in (lags, -lags):
+            lag_bins = bin_lags(signed_lags, bin_edges)
+            in_range = lag_bins >= 0
+            flat_counts += np.bincount(pair_rows[in_range] + lag_bins[in_range], minlength=n_clusters * n_bins)
     
-        # Calculate the weighted sum of positive bin centers
-        weighted_sum = np.sum(positive_bin_centers * positive_counts)
+    return flat_counts.reshape(n_clusters, n_bins), bin_centers, cluster_ids
 
-        # Calculate the total count in positive bins
-        total_positive_count = np.sum(positive_counts)
+def autocorrelogram_first_moments(autocorrelograms, bin_centers):
+    """
+    Compute the first moment (mean lag) of the positive-lag part of each autocorrelogram, in milliseconds.
+    
+    Parameters:
+    - autocorrelograms (numpy array): Counts of shape (n_clusters, n_bins), from compute_autocorrelogram_matrix.
+    - bin_centers (numpy array): Centre of each bin, in seconds.
+    
+    Returns:
+    - numpy array: First moment of each cluster's autocorrelogram (in ms). NaN if there are no positive-lag counts.
+    """
+    positive_bins = bin_centers > 0
+    positive_counts = autocorrelograms[:, positive_bins]
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return positive_counts @ (bin_centers[positive_bins] * 1000) / positive_counts.sum(axis=1)
 
-        # Calculate the mean of the positive parts
-        moment = weighted_sum / total_positive_count
-        
-        # Store first moment in dictionary
-        first_moments[cluster] = moment
+def autocorrelogram_burst_ratios(autocorrelograms, bin_centers, burst_threshold=0.006):
+    """
+    Compute the burst ratio of each autocorrelogram: the fraction of positive-lag counts at lags up to burst_threshold.
+    This counts all spike pairs, so it differs from the spike-based 'burst_index' of isi_statistics.compute_isi_statistics.
+    
+    Parameters:
+    - autocorrelograms (numpy array): Counts of shape (n_clusters, n_bins), from compute_autocorrelogram_matrix.
+    - bin_centers (numpy array): Centre of each bin, in seconds.
+    - burst_threshold (float): Maximum lag counted as bursting, in seconds. Default is 0.006 s, as in compute_isi_statistics.
+    
+    Returns:
+    - numpy array: Burst ratio of each cluster. NaN if there are no positive-lag counts.
+    """
+    positive_bins = bin_centers > 0
+    burst_bins = positive_bins & (bin_centers <= burst_threshold)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return autocorrelograms[:, burst_bins].sum(axis=1) / autocorrelograms[:, positive_bins].sum(axis=1)
 
-#         ### CALCULATE BURST INDICES - CURRENTLY UNUSED
-#         # Calculate inter-spike intervals (ISIs) for burst index
-#         isis = np.diff(cluster_spike_times)
-        
-#         # Identify burst spikes based on ISIs and the burst threshold using boolean indexing
-#         burst_spikes = np.nonzero(isis < burst_threshold)[0]
-        
-#         # Make sure each spike is counted only once for burst index calculation
-#         burst_spikes = np.concatenate([burst_spikes, burst_spikes + 1])
-#         burst_spikes = np.unique(burst_spikes)
-        
-#         # Count the unique number of burst spikes
-#         num_burst_spikes = burst_spikes.size
-        
-#         # Calculate the burst index
-#         burst_index = num_burst_spikes / cluster_spike_times.size
-        
-#         # Store burst index in dictionary
-#         burst_indices[cluster] = burst_index
+def compute_autocorrelograms_and_first_moment(spike_times, spike_clusters, bin_size, time_window, spike_trials=None):
+    """
+    Adapted function to compute autocorrelograms and first moments (in ms) for multiple clusters, 
+    returning them as separate dictionaries. Includes acWin to constrain bins for first moment calculation.
+    
+    Autocorrelograms count every pair of spikes within time_window (see compute_autocorrelogram_matrix), and are
+    computed for all clusters at once. Burst ratios can be taken from the same counts with autocorrelogram_burst_ratios.
+    
+    Parameters:
+    - spike_times (numpy array): Array of spike times in seconds.
+    - spike_clusters (numpy array): Array of cluster IDs corresponding to each spike time.
+    - bin_size (float): The size of the bins for the autocorrelogram in seconds.
+    - time_window (float): The time window around each spike to consider for autocorrelation and first moment in seconds.
+    - spike_trials (numpy array, optional): Trial of each spike, so that only spikes in the same trial are paired. Default is None.
+    
+    Returns:
+    - autocorrelograms (dict): A dictionary containing the bin centers and counts for each cluster's autocorrelogram.
+    - first_moments (dict): A dictionary containing the first moment for each cluster's autocorrelogram (in ms).
+    """
+    counts, bin_centers, cluster_ids = compute_autocorrelogram_matrix(spike_times, spike_clusters, bin_size, time_window, spike_trials=spike_trials)
+    first_moments = autocorrelogram_first_moments(counts, bin_centers)
+    
+    autocorrelograms = {cluster: {'bin_centers': bin_centers, 'counts': counts[i]} for i, cluster in enumerate(cluster_ids)}
+    first_moments = dict(zip(cluster_ids, first_moments))
         
-    return autocorrelograms, first_moments#, burst_indices
+    return autocorrelograms, first_moments
 
 
 def plot_autocorrelogram(session, cluster, autocorrelogram, first_moment): #burst_index,
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from .burst_index_and_autocorrelograms import make_sweep_times, expand_ranges, assign_cluster_rows, bin_lags
+
+def compute_ccg_matrix(spike_times, spike_clusters, bin_size, time_window, spike_trials=None, clusters=None, n_jobs=-1,
+                       max_memory_gb=2.0, output='dense', top_k=100, peak_window=0.005, output_path=None):
+    """
+    Compute cross-correlograms for all pairs of clusters from the flat spike vector of ephys.load_spikes, to flag
+    duplicate units and putative monosynaptic connections.
+
+    Spikes of all clusters are sorted by (trial, time) once. For every spike of a block of reference clusters, all spikes
+    within time_window are found with np.searchsorted (the same windowed sweep as compute_autocorrelogram_matrix) and
+    histogrammed with np.bincount. Blocks of reference clusters are processed in parallel (joblib processes), with the
+    block size and the number of spike pairs held at once set so that the result and all workers together stay within
+    max_memory_gb.
+
+    ccg[i, j, b] counts spikes of cluster j at lag bin b relative to spikes of cluster i, so ccg[j, i] is ccg[i, j]
+    reversed in lag. The diagonal holds the autocorrelograms (identical spikes excluded).
+
+    Parameters:
+    - spike_times (numpy array): Array of spike times in seconds.
+    - spike_clusters (numpy array): Array of cluster IDs corresponding to each spike time.
+    - bin_size (float): The size of the bins in seconds.
+    - time_window (float): Maximum lag in seconds.
+    - spike_trials (numpy array, optional): Trial of each spike, so that only spikes in the same trial are paired. Default is None.
+    - clusters (array-like, optional): Cluster IDs to include, in output order. Default is all clusters, sorted.
+    - n_jobs (int or None): Number of parallel processes, as for joblib.Parallel. Default is -1 (all CPUs).
+    - max_memory_gb (float): Approximate memory cap, in GB, for the result and all workers together. Raises a
+      ValueError if the 'dense' result alone would not fit. Default is 2 GB.
+    - output (str): 'dense' for the full (n_clusters, n_clusters, n_bins) counts, or 'top_k' for a summary of the
+      pairs with the strongest peaks near zero lag. Default is 'dense'.
+    - top_k (int): Number of pairs in the 'top_k' summary. Default is 100.
+    - peak_window (float): Maximum absolute lag of the peak in the 'top_k' summary, in seconds. Default is 0.005 s.
+    - output_path (str, optional): For 'dense' output, also save the counts, bin centres and cluster IDs to this
+      path with np.savez_compressed. Default is None.
+
+    Returns:
+    - ccg (numpy array or pd.DataFrame): For 'dense', counts of shape (n_clusters, n_clusters, n_bins), stored in the
+      smallest unsigned integer type that holds them. For 'top_k', a DataFrame with one row per pair (cluster_1 < cluster_2
+      in row order) and columns 'cluster_1', 'cluster_2', 'peak_lag' (s), 'peak_count', 'baseline' (mean count at
+      lags outside peak_window) and 'peak_ratio' (peak_count / baseline), sorted by peak_ratio.
+    - bin_centers (numpy array): Centre of each bin, in seconds.
+    - cluster_ids (numpy array): Cluster ID of each row.
+    """
+    if output not in ('dense', 'top_k'):
+        raise ValueError("output must be 'dense' or 'top_k'")
+
+    bin_edges = np.arange(-time_window, time_window + bin_size, bin_size)
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    n_bins = len(bin_centers)
+
+    spike_times = np.asarray(spike_times, dtype=float)
+    spike_clusters = np.asarray(spike_clusters)
+    cluster_ids = np.unique(spike_clusters) if clusters is None else np.asarray(clusters)
+    n_clusters = len(cluster_ids)
+
+    spike_rows, included = assign_cluster_rows(spike_clusters, cluster_ids)
+    spike_times, spike_rows = spike_times[included], spike_rows[included]
+    spike_groups = None if spike_trials is None else np.asarray(spike_trials)[included]
+
+    # Sort spikes of all clusters by (trial, time) once
+    order = np.argsort(spike_times, kind='stable') if spike_groups is None else np.lexsort((spike_times, spike_groups))
+    spike_times, spike_rows = spike_times[order], spike_rows[order]
+    sweep_times = make_sweep_times(spike_times, None if spike_groups is None else spike_groups[order], time_window)
+
+    # The dense result is held in the parent twice: as int64 counts, and as the final smaller-dtype copy
+    result_bytes = n_clusters * n_clusters * n_bins * 16 if output == 'dense' else 0
+    if result_bytes >= max_memory_gb * 1e9:
+        raise ValueError(f"Dense cross-correlograms need {result_bytes / 1e9:.3g} GB, more than max_memory_gb; "
+                         "use output='top_k' or increase max_memory_gb")
+
+    # Split the rest of the memory cap between workers: half for the block counts, half for spike pairs (~64 bytes each).
+    # Each block count takes 8 bytes (int64), 8 more for the np.bincount of each chunk, and for 'dense' output 8 more
+    # for the copy returned to the parent
+    n_workers = max(1, min(effective_n_jobs(n_jobs), n_clusters))
+    worker_bytes = (max_memory_gb * 1e9 - result_bytes) / n_workers
+    block_entry_bytes = 24 if output == 'dense' else 16
+    block_size = int(np.clip(worker_bytes / 2 // (max(n_clusters, 1) * n_bins * block_entry_bytes), 1, max(1, -(-n_clusters // n_workers))))
+    max_pairs = max(int(worker_bytes / 2 // 64), 1000)
+
+    block_starts = np.arange(0, n_clusters, block_size)
+    with Parallel(n_jobs=n_jobs, return_as='generator') as parallel:
+        block_results = parallel(
+            delayed(_ccg_block)(sweep_times, spike_times, spike_rows, block_start, min(block_start + block_size, n_clusters),
+                                n_clusters, bin_edges, time_window, max_pairs, output, top_k, peak_window)
+            for block_start in block_starts
+        )
+
+        if output == 'top_k':
+            block_summaries = list(block_results) or [pd.DataFrame(columns=['cluster_1', 'cluster_2', 'peak_lag', 'peak_count', 'baseline', 'peak_ratio'])]
+            summary = pd.concat(block_summaries, ignore_index=True).sort_values('peak_ratio', ascending=False).head(top_k)
+            summary['cluster_1'] = cluster_ids[summary['cluster_1'].to_numpy(dtype=int)]
+            summary['cluster_2'] = cluster_ids[summary['cluster_2'].to_numpy(dtype=int)]
+            return summary.reset_index(drop=True), bin_centers, cluster_ids
+
+        # Copy each block into the result as it arrives, so that only one full set of int64 counts is held
+        ccg = np.zeros((n_clusters, n_clusters, n_bins), dtype=np.int64)
+        for block_start, block_counts in zip(block_starts, block_results):
+            ccg[block_start:block_start + len(block_counts)] = block_counts
+
+    ccg = ccg.astype(np.min_scalar_type(ccg.max() if ccg.size else 0))
+
+    if output_path is not None:
+        np.savez_compressed(output_path, ccg=ccg, bin_centers=bin_centers, cluster_ids=cluster_ids)
+
+    return ccg, bin_centers, cluster_ids
+
+def _ccg_block(sweep_times, spike_times, spike_rows, block_start, block_stop, n_clusters, bin_edges, time_window, max_pairs,
+               output, top_k, peak_window):
+    """
+    Cross-correlograms of a block of reference clusters (rows block_start:block_stop) against all clusters.
+    Returns the block counts, or a DataFrame of the block's top_k pairs for 'top_k' output.
+    """
+    n_bins = len(bin_edges) - 1
+    n_block = block_stop - block_start
+
+    # All spikes within the window of each reference spike. The window is searched one bin wider, as the trial
+    # offsets in sweep_times round spike times, and pairs at exactly +-time_window are binned on their true lag
+    reference_spikes = np.flatnonzero((spike_rows >= block_start) & (spike_rows < block_stop))
+    search_window = time_window + (bin_edges[1] - bin_edges[0])
+    window_starts = np.searchsorted(sweep_times, sweep_times[reference_spikes] - search_window, side='left')
+    window_ends = np.searchsorted(sweep_times, sweep_times[reference_spikes] + search_window, side='right')
+    n_partners = window_ends - window_starts
+
+    # Process reference spikes in chunks of at most about max_pairs pairs
+    cumulative_pairs = np.cumsum(n_partners)
+    chunk_edges = np.searchsorted(cumulative_pairs, np.arange(max_pairs, cumulative_pairs[-1] if len(cumulative_pairs) else 0, max_pairs))
+    chunk_edges = np.unique(np.concatenate([[0], chunk_edges + 1, [len(reference_spikes)]]))
+
+    block_counts = np.zeros(n_block * n_clusters * n_bins, dtype=np.int64)
+    for chunk_start, chunk_stop in zip(chunk_edges[:-1], chunk_edges[1:]):
+        chunk_partners = n_partners[chunk_start:chunk_stop]
+        first = np.repeat(reference_spikes[chunk_start:chunk_stop], chunk_partners)
+        second = expand_ranges(window_starts[chunk_start:chunk_stop], chunk_partners)
+
+        # Exclude each spike paired with itself
+        not_self = first != second
+        first, second = first[not_self], second[not_self]
+
+        lag_bins = bin_lags(spike_times[second] - spike_times[first], bin_edges)
+        in_range = lag_bins >= 0
+        flat_bins = ((spike_rows[first] - block_start) * n_clusters + spike_rows[second]) * n_bins + lag_bins
+        block_counts += np.bincount(flat_bins[in_range], minlength=block_counts.size)
+
+    block_counts = block_counts.reshape(n_block, n_clusters, n_bins)
+    if output == 'dense':
+        return block_counts
+
+    # Peak near zero lag relative to the baseline at longer lags, for pairs with cluster_2 after cluster_1
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    peak_bins = np.abs(bin_centers) <= peak_window
+    rows, columns = np.nonzero(np.arange(n_clusters)[None, :] > np.arange(block_start, block_stop)[:, None])
+    pair_counts = block_counts[rows, columns]
+
+    peak_index = np.argmax(pair_counts[:, peak_bins], axis=1)
+    peak_count = pair_counts[:, peak_bins][np.arange(len(rows)), peak_index]
+    baseline = pair_counts[:, ~peak_bins].mean(axis=1) if (~peak_bins).any() else np.full(len(rows), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        peak_ratio = np.where(baseline > 0, peak_count / baseline, np.nan)
+
+    # Keep the block's top_k pairs
+    keep = np.argsort(-np.nan_to_num(peak_ratio, nan=-np.inf), kind='stable')[:top_k]
+    return pd.DataFrame({
+        'cluster_1': rows[keep] + block_start,
+        'cluster_2': columns[keep],
+        'peak_lag': bin_centers[peak_bins][peak_index[keep]],
+        'peak_count': peak_count[keep],
+        'baseline': baseline[keep],
+        'peak_ratio': peak_ratio[keep],
+    })
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from .burst_index_and_autocorrelograms import assign_cluster_rows
+
+def compute_isi_statistics(spike_times, spike_clusters, spike_trials=None, clusters=None, burst_threshold=0.006,
+                           refractory_period=0.0015, isi_bin_size=0.001, isi_window=0.1):
+    """
+    Compute inter-spike interval (ISI) statistics for every cluster in one pass over the cluster-sorted spike vector.
+    Spikes are sorted by (cluster, trial, time) once, and every statistic is a segmented reduction (np.bincount over
+    cluster rows) of the ISIs, or of pairs of consecutive ISIs, that lie within one cluster and trial.
+
+    Statistics:
+    - burst_index: Fraction of spikes with an ISI below burst_threshold before or after them (each spike counted once).
+      Not the same as the all-pairs autocorrelogram_burst_ratios, which uses the same default burst_threshold.
+    - cv: Coefficient of variation of the ISIs (standard deviation / mean).
+    - cv2: Mean of 2 |ISI(i+1) - ISI(i)| / (ISI(i+1) + ISI(i)) over consecutive ISIs (Holt et al., 1996).
+    - lv: Local variation, 3 * mean of ((ISI(i) - ISI(i+1)) / (ISI(i) + ISI(i+1)))^2 over consecutive ISIs (Shinomoto et al., 2003).
+    - refractory_violations: Number of ISIs below refractory_period, and refractory_violation_rate as a fraction of ISIs.
+
+    Parameters:
+    - spike_times (numpy array): Array of spike times in seconds.
+    - spike_clusters (numpy array): Array of cluster IDs corresponding to each spike time.
+    - spike_trials (numpy array, optional): Trial of each spike. If given, ISIs are not taken across trials, as spike times
+      from ephys.load_spikes restart at each trial. Default is None.
+    - clusters (array-like, optional): Cluster IDs to include, in output order. Default is all clusters, sorted.
+    - burst_threshold (float): Maximum ISI within a burst, in seconds. Default is 0.006 s.
+    - refractory_period (float): ISIs below this are refractory period violations, in seconds. Default is 0.0015 s.
+    - isi_bin_size (float): Bin size of the ISI histograms, in seconds. Default is 0.001 s.
+    - isi_window (float): Maximum ISI in the ISI histograms, in seconds. Default is 0.1 s.
+
+    Returns:
+    - isi_df (pd.DataFrame): One row per cluster, indexed by 'cluster' (as the rate map and spatial significance
+      tables), with columns 'n_spikes', 'n_isis', 'mean_isi', 'burst_index', 'cv', 'cv2', 'lv',
+      'refractory_violations' and 'refractory_violation_rate'. Statistics without enough ISIs are NaN.
+    - isi_histograms (numpy array): ISI counts of shape (n_clusters, n_bins).
+    - bin_edges (numpy array): Edges of the ISI histogram bins, in seconds.
+    """
+    spike_times = np.asarray(spike_times, dtype=float)
+    spike_clusters = np.asarray(spike_clusters)
+    cluster_ids = np.unique(spike_clusters) if clusters is None else np.asarray(clusters)
+    n_clusters = len(cluster_ids)
+
+    spike_rows, included = assign_cluster_rows(spike_clusters, cluster_ids)
+    spike_times, spike_rows = spike_times[included], spike_rows[included]
+    spike_trials = np.zeros(len(spike_times), dtype=int) if spike_trials is None else np.asarray(spike_trials)[included]
+
+    # Sort spikes by (cluster, trial, time) once
+    order = np.lexsort((spike_times, spike_trials, spike_rows))
+    spike_times, spike_rows, spike_trials = spike_times[order], spike_rows[order], spike_trials[order]
+
+    # ISIs within each cluster and trial
+    isis = np.diff(spike_times)
+    isi_valid = (spike_rows[1:] == spike_rows[:-1]) & (spike_trials[1:] == spike_trials[:-1])
+    isi_rows = spike_rows[1:]
+
+    def segment_sum(rows, values=None):
+        return np.bincount(rows, values, minlength=n_clusters)
+
+    n_spikes = segment_sum(spike_rows)
+    valid_isis, valid_isi_rows = isis[isi_valid], isi_rows[isi_valid]
+    n_isis = segment_sum(valid_isi_rows)
+    isi_sum = segment_sum(valid_isi_rows, valid_isis)
+    isi_sq_sum = segment_sum(valid_isi_rows, valid_isis ** 2)
+
+    # Burst spikes: a burst ISI before or after the spike
+    burst_isi = isi_valid & (isis < burst_threshold)
+    is_burst_spike = np.zeros(len(spike_times), dtype=bool)
+    is_burst_spike[:-1] |= burst_isi
+    is_burst_spike[1:] |= burst_isi
+    n_burst_spikes = segment_sum(spike_rows[is_burst_spike])
+
+    # Consecutive ISI pairs within each cluster and trial
+    pair_valid = isi_valid[1:] & isi_valid[:-1]
+    isi_1, isi_2 = isis[:-1][pair_valid], isis[1:][pair_valid]
+    pair_rows = isi_rows[1:][pair_valid]
+    n_pairs = segment_sum(pair_rows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv2_terms = np.nan_to_num(2 * np.abs(isi_2 - isi_1) / (isi_2 + isi_1))
+        lv_terms = np.nan_to_num(((isi_1 - isi_2) / (isi_1 + isi_2)) ** 2)
+
+    refractory_violations = segment_sum(valid_isi_rows[valid_isis < refractory_period])
+
+    # ISI histograms for all clusters at once
+    bin_edges = np.arange(0, isi_window + isi_bin_size, isi_bin_size)
+    n_bins = len(bin_edges) - 1
+    isi_bins = np.searchsorted(bin_edges, valid_isis, side='right') - 1
+    isi_bins[valid_isis == bin_edges[-1]] = n_bins - 1
+    in_range = (isi_bins >= 0) & (isi_bins < n_bins)
+    isi_histograms = np.bincount(valid_isi_rows[in_range] * n_bins + isi_bins[in_range], minlength=n_clusters * n_bins).reshape(n_clusters, n_bins)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_isi = isi_sum / n_isis
+        isi_std = np.sqrt(np.maximum(isi_sq_sum / n_isis - mean_isi ** 2, 0))
+        isi_df = pd.DataFrame({
+            'n_spikes': n_spikes,
+            'n_isis': n_isis,
+            'mean_isi': mean_isi,
+            'burst_index': n_burst_spikes / n_spikes,
+            'cv': np.where(n_isis > 1, isi_std / mean_isi, np.nan),
+            'cv2': np.where(n_pairs > 0, segment_sum(pair_rows, cv2_terms) / n_pairs, np.nan),
+            'lv': np.where(n_pairs > 0, 3 * segment_sum(pair_rows, lv_terms) / n_pairs, np.nan),
+            'refractory_violations': refractory_violations,
+            'refractory_violation_rate': refractory_violations / n_isis,
+        }, index=pd.Index(cluster_ids, name='cluster'))
+
+    return isi_df, isi_histograms, bin_edges
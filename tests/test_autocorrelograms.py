@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from postprocessing.burst_index_and_autocorrelograms import compute_autocorrelogram_matrix
+
+def brute_force_autocorrelograms(spike_times, spike_clusters, spike_trials, bin_size, time_window):
+    """
+    Autocorrelograms from the lags of all pairs of distinct spikes in the same cluster and trial, binned with np.histogram.
+    """
+    bin_edges = np.arange(-time_window, time_window + bin_size, bin_size)
+    counts = []
+    for cluster in np.unique(spike_clusters):
+        cluster_counts = np.zeros(len(bin_edges) - 1, dtype=np.int64)
+        for trial in np.unique(spike_trials):
+            times = spike_times[(spike_clusters == cluster) & (spike_trials == trial)]
+            lags = times[None, :] - times[:, None]
+            cluster_counts += np.histogram(lags[~np.eye(len(times), dtype=bool)], bins=bin_edges)[0]
+        counts.append(cluster_counts)
+    return np.array(counts)
+
+@pytest.mark.parametrize('seed', range(20))
+def test_autocorrelogram_matrix_matches_brute_force(seed):
+    # Spike times on a 48 kHz sample clock over a long recording, with half of the spikes exactly time_window
+    # (2400 samples) after another, so that many lags fall on the bin edges and on +-time_window
+    rng = np.random.default_rng(seed)
+    n_spikes = 3000
+    spike_samples = rng.integers(0, 48000 * 1000, n_spikes)
+    spike_samples[1::2] = spike_samples[::2] + 2400
+    spike_times = spike_samples / 48000
+    spike_clusters = rng.integers(0, 5, n_spikes)
+    spike_trials = rng.integers(0, 4, n_spikes)
+    bin_size, time_window = 0.001, 0.05
+
+    counts, _, cluster_ids = compute_autocorrelogram_matrix(spike_times, spike_clusters, bin_size, time_window,
+                                                            spike_trials=spike_trials, max_pairs=5000)
+
+    np.testing.assert_array_equal(cluster_ids, np.unique(spike_clusters))
+    np.testing.assert_array_equal(counts, brute_force_autocorrelograms(spike_times, spike_clusters, spike_trials,
+                                                                      bin_size, time_window))
+
+def test_autocorrelogram_matrix_with_no_clusters():
+    spike_times = np.sort(np.random.default_rng(0).random(100))
+    spike_clusters = np.arange(100) % 3
+
+    counts, bin_centers, cluster_ids = compute_autocorrelogram_matrix(spike_times, spike_clusters, 0.001, 0.05, clusters=[])
+
+    assert counts.shape == (0, len(bin_centers))
+    assert len(cluster_ids) == 0
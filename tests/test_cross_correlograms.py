@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from postprocessing.cross_correlograms import compute_ccg_matrix
+
+def brute_force_ccg(spike_times, spike_clusters, spike_trials, cluster_1, cluster_2, bin_edges):
+    """
+    Cross-correlogram of cluster_2 relative to cluster_1 from the lags of all pairs of distinct spikes in the same trial.
+    """
+    counts = np.zeros(len(bin_edges) - 1, dtype=np.int64)
+    for trial in np.unique(spike_trials):
+        spikes_1 = np.flatnonzero((spike_clusters == cluster_1) & (spike_trials == trial))
+        spikes_2 = np.flatnonzero((spike_clusters == cluster_2) & (spike_trials == trial))
+        lags = spike_times[spikes_2][None, :] - spike_times[spikes_1][:, None]
+        counts += np.histogram(lags[spikes_2[None, :] != spikes_1[:, None]], bins=bin_edges)[0]
+    return counts
+
+@pytest.mark.parametrize('seed', range(5))
+def test_ccg_matrix_matches_brute_force(seed):
+    # Spike times on a 48 kHz sample clock, with half of the spikes exactly time_window after another
+    rng = np.random.default_rng(seed)
+    n_spikes = 2000
+    spike_samples = rng.integers(0, 48000 * 1000, n_spikes)
+    spike_samples[1::2] = spike_samples[::2] + 2400
+    spike_times = spike_samples / 48000
+    spike_clusters = rng.integers(0, 4, n_spikes)
+    spike_trials = rng.integers(0, 4, n_spikes)
+    bin_size, time_window = 0.001, 0.05
+    bin_edges = np.arange(-time_window, time_window + bin_size, bin_size)
+
+    ccg, _, cluster_ids = compute_ccg_matrix(spike_times, spike_clusters, bin_size, time_window, spike_trials=spike_trials,
+                                             n_jobs=1, max_memory_gb=0.001)
+
+    for i, cluster_1 in enumerate(cluster_ids):
+        for j, cluster_2 in enumerate(cluster_ids):
+            np.testing.assert_array_equal(ccg[i, j], brute_force_ccg(spike_times, spike_clusters, spike_trials,
+                                                                     cluster_1, cluster_2, bin_edges))
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+from scipy.signal import firwin, filtfilt
+
+from analysis.get_theta_phase import zero_phase_fir_filter
+
+@pytest.mark.parametrize('n_samples', [3000, 20000])
+def test_zero_phase_fir_filter_matches_filtfilt(n_samples):
+    # Theta band-pass taps as used by get_theta_phase, on a multi-channel LFP
+    sampling_rate = 250
+    filter_taps = firwin(sampling_rate + 1, [6, 10], pass_zero=False, window='blackman', fs=sampling_rate)
+    pad_length = 3 * (len(filter_taps) - 1)
+    rng = np.random.default_rng(0)
+    lfp = rng.standard_normal((n_samples, 4)).cumsum(axis=0)
+
+    expected = filtfilt(filter_taps, 1, lfp, axis=0, padlen=pad_length)
+    filtered = zero_phase_fir_filter(lfp, filter_taps, pad_length)
+
+    np.testing.assert_allclose(filtered, expected, rtol=0, atol=1e-10 * np.abs(expected).max())